@@ -1,5 +1,6 @@
 
 import streamlit as st
+from application_pages.profiling import PROFILE_DEFAULT, profiled_run, render_profile_panel
 st.set_page_config(page_title="QuLab: Operational Risk Measurement", layout="wide")
 st.sidebar.image("https://www.quantuniversity.com/assets/img/logo5.jpg")
 st.sidebar.divider()
@@ -7,15 +8,20 @@ st.title("QuLab: Operational Risk Measurement")
 st.divider()
 
 page = st.sidebar.selectbox(label="Navigation", options=["Data Loading & Analysis", "Risk Profile Grid", "Analytics & Visualizations"])
-if page == "Data Loading & Analysis":
-    from application_pages.data_loading_and_analysis import run_data_loading_and_analysis
-    run_data_loading_and_analysis()
-elif page == "Risk Profile Grid":
-    from application_pages.risk_profile import run_risk_profile
-    run_risk_profile()
-elif page == "Analytics & Visualizations":
-    from application_pages.analytics_and_visualizations import run_analytics_and_visualizations
-    run_analytics_and_visualizations()
+profiling = st.sidebar.toggle("Performance panel", value=PROFILE_DEFAULT,
+                              help="Time each page section and record its peak memory. Adds some overhead while on.")
+with profiled_run(page, enabled=profiling):
+    if page == "Data Loading & Analysis":
+        from application_pages.data_loading_and_analysis import run_data_loading_and_analysis
+        run_data_loading_and_analysis()
+    elif page == "Risk Profile Grid":
+        from application_pages.risk_profile import run_risk_profile
+        run_risk_profile()
+    elif page == "Analytics & Visualizations":
+        from application_pages.analytics_and_visualizations import run_analytics_and_visualizations
+        run_analytics_and_visualizations()
+if profiling:
+    render_profile_panel()
 
 
 # License
@@ -1,8 +1,401 @@
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+
 import streamlit as st
 import pandas as pd
 import numpy as np
 import plotly.express as px
 
+from application_pages.cube import CUBE_MEASURES
+from application_pages.datasets import dataset_identity, load_risklab_cube, load_risklab_frame
+from application_pages.jobs import run_in_background, session_jobs, start_job, wait_for_job
+from application_pages.profiling import profile_section, span
+
+ANALYTICS_COLUMNS = ['Date', 'Cost per Trade', 'Risk Category', 'Severity', 'Likelihood', 'Firm Type']
+VARIABILITY_WINDOWS = {'Day': 'D', 'Week': 'W', 'Month': 'MS'}
+# Trend chart: default number of x-axis buckets (roughly the chart width in pixels)
+# and the point count above which traces switch to WebGL.
+TREND_BUCKETS = 1200
+WEBGL_MIN_POINTS = 1000
+# Loss simulation: the most scenarios per chunk (each chunk has its own RNG stream),
+# the expected loss events per chunk (about 40 bytes each while a chunk runs, so
+# ~80 MB per worker whatever the frequency scale) and the floor on the lognormal
+# shape so constant-cost categories still vary.
+SIMULATION_CHUNK = 250_000
+SIMULATION_EVENT_BUDGET = 2_000_000
+MIN_LOSS_SIGMA = 0.1
+VAR_LEVELS = [0.95, 0.99, 0.995, 0.999]
+
+
+def cost_variability(cost_data):
+    """Std (population), range, mean and normalized std of ``cost_data`` in one set of reductions.
+
+    Works on the column buffer directly (no Python list); values are shifted by the
+    first element before summing squares to keep the single-pass variance stable.
+    """
+    values = np.asarray(cost_data, dtype=np.float64)
+    if values.size == 0:
+        raise ValueError("Cost data cannot be empty.")
+    shift = values[0]
+    shifted = values - shift
+    return variability_from_aggregates(values.size, shifted.sum(), np.dot(shifted, shifted),
+                                       values.min(), values.max(), shift=shift)
+
+
+def variability_from_aggregates(count, total, total_sq, minimum, maximum, shift=0.0):
+    """Turn count/sum/sum-of-squares/min/max into the variability metrics.
+
+    Accepts scalars or aligned arrays (one entry per group or window). ``total`` and
+    ``total_sq`` are the sum and the sum of squares of the values minus ``shift``;
+    a shift near the data keeps the single-pass variance stable.
+    """
+    count = np.asarray(count, dtype=np.float64)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean_shifted = np.asarray(total, dtype=np.float64) / count
+        mean = shift + mean_shifted
+        variance = np.maximum(np.asarray(total_sq, dtype=np.float64) / count - mean_shifted ** 2, 0.0)
+        std = np.where(count > 1, np.sqrt(variance), 0.0)
+        data_range = np.asarray(maximum, dtype=np.float64) - np.asarray(minimum, dtype=np.float64)
+        normalized = np.where(data_range > 0, std / data_range, 0.0)
+    result = {'count': count, 'mean': mean, 'std': std, 'range': data_range, 'normalized_std': normalized}
+    if np.ndim(count) == 0:
+        return {key: float(value) for key, value in result.items()}
+    return result
+
+
+def cube_variability(cube):
+    shift = cube_mean(cube)
+    totals = cube_aggregates(cube.assign(_all='All'), ['_all'], shift).iloc[0]
+    return variability_from_aggregates(totals['count'], totals['total'], totals['total_sq'],
+                                       totals['minimum'], totals['maximum'], shift=shift)
+
+
+def cube_mean(cube):
+    return float(cube['total'].sum() / cube['count'].sum())
+
+
+def cost_aggregates(df, keys, shift=0.0):
+    """Count/sum/sum-of-squares/min/max of 'Cost per Trade' per ``keys``, read from rows.
+
+    The sums are of the costs minus ``shift``.
+    """
+    cost = df['Cost per Trade'].astype(np.float64)
+    shifted = cost - shift
+    frame = pd.DataFrame({'cost': cost, 'shifted': shifted, 'shifted_sq': shifted * shifted}, index=df.index)
+    for key in keys:
+        col = key.key if isinstance(key, pd.Grouper) else key
+        frame[col] = df[col]
+    return frame.groupby(keys, observed=True).agg(
+        count=('cost', 'count'), total=('shifted', 'sum'), total_sq=('shifted_sq', 'sum'),
+        minimum=('cost', 'min'), maximum=('cost', 'max'))
+
+
+def cube_aggregates(cube, keys, shift=0.0):
+    """The same aggregates as ``cost_aggregates`` rolled up from the pre-aggregated cube.
+
+    Each cell's sums about ``shift`` are rebuilt from its mean and ``m2``.
+    """
+    deviation = cube['total'] / cube['count'] - shift
+    cells = cube.assign(total=cube['count'] * deviation, total_sq=cube['m2'] + cube['count'] * deviation ** 2)
+    measures = {measure: how for measure, how in CUBE_MEASURES.items() if measure != 'severity_total'}
+    return cells.groupby(keys, observed=True).agg({**measures, 'total_sq': 'sum'})
+
+
+def grouped_cost_variability(df, by=None, freq=None, rolling=1, cube=None):
+    """Variability of 'Cost per Trade' per group and/or per ``freq`` window of 'Date'.
+
+    With ``rolling`` > 1 each row covers the trailing ``rolling`` calendar windows of
+    its group, empty windows included, so a gap in trading shortens the span of data.
+    Windows are merged from their count/sum/sum-of-squares/min/max, so the result is
+    exact without revisiting rows. When ``cube`` is given, rows are not read at all.
+    """
+    keys = list(by or [])
+    if freq is not None:
+        keys.append(pd.Grouper(key='Date', freq=freq))
+    # One shift for every group keeps the sums additive across rolling windows.
+    shift = cube_mean(cube) if cube is not None else float(df['Cost per Trade'].mean())
+    if not keys:
+        totals = cube_aggregates(cube.assign(_all='All'), ['_all'], shift) if cube is not None else cost_aggregates(df.assign(_all='All'), ['_all'], shift)
+        return variability_table(totals, shift).drop(columns='_all')
+
+    aggregates = cube_aggregates(cube, keys, shift) if cube is not None else cost_aggregates(df, keys, shift)
+    aggregates = aggregates[aggregates['count'] > 0]
+
+    if freq is not None and rolling > 1:
+        aggregates = fill_empty_windows(aggregates, by, freq)
+        sums = ['count', 'total', 'total_sq']
+        if by:
+            grouped = aggregates.groupby(level=list(range(len(by))), observed=True, group_keys=False)
+            rolled_sums = grouped[sums].rolling(rolling, min_periods=1).sum().droplevel(list(range(len(by))))
+            rolled_min = grouped['minimum'].rolling(rolling, min_periods=1).min().droplevel(list(range(len(by))))
+            rolled_max = grouped['maximum'].rolling(rolling, min_periods=1).max().droplevel(list(range(len(by))))
+        else:
+            rolled_sums = aggregates[sums].rolling(rolling, min_periods=1).sum()
+            rolled_min = aggregates['minimum'].rolling(rolling, min_periods=1).min()
+            rolled_max = aggregates['maximum'].rolling(rolling, min_periods=1).max()
+        aggregates = rolled_sums.assign(minimum=rolled_min, maximum=rolled_max)
+        aggregates = aggregates[aggregates['count'] > 0]
+
+    return variability_table(aggregates, shift)
+
+
+def fill_empty_windows(aggregates, by, freq):
+    """Reindex each group onto every ``freq`` window between the first and last date.
+
+    Added windows have zero count and sums and NaN min/max, which the rolling
+    sum/min/max skip, so a trailing window of ``n`` rows spans ``n`` periods of time.
+    """
+    dates = aggregates.index.get_level_values('Date')
+    periods = pd.date_range(dates.min(), dates.max(), freq=freq, name='Date')
+    if by:
+        groups = aggregates.index.droplevel('Date').unique()
+        full = pd.MultiIndex.from_arrays(
+            [np.repeat(groups.get_level_values(i), len(periods)) for i in range(groups.nlevels)] + [np.tile(periods, len(groups))],
+            names=aggregates.index.names)
+    else:
+        full = periods
+    return aggregates.reindex(full).fillna({'count': 0, 'total': 0.0, 'total_sq': 0.0})
+
+
+def variability_table(aggregates, shift=0.0):
+    metrics = variability_from_aggregates(aggregates['count'], aggregates['total'], aggregates['total_sq'],
+                                          aggregates['minimum'], aggregates['maximum'], shift=shift)
+    result = pd.DataFrame({
+        'Trades': metrics['count'].astype(np.int64),
+        'Mean Cost': metrics['mean'],
+        'Std Dev': metrics['std'],
+        'Range': metrics['range'],
+        'Normalized Std Dev': metrics['normalized_std'],
+    }, index=aggregates.index)
+    return result.reset_index()
+
+
+def downsample_min_max(x, y, buckets):
+    """Indices of the points to draw so that every spike survives (M4 downsampling).
+
+    ``x`` must be sorted. The x range is split into ``buckets`` equal-width buckets
+    and each bucket keeps its first, last, minimum and maximum point, so at most
+    ``4 * buckets`` points are returned, in x order.
+    """
+    n = len(x)
+    if n <= 4 * buckets:
+        return np.arange(n)
+    xi = x.astype(np.int64) if np.issubdtype(x.dtype, np.datetime64) else np.asarray(x, dtype=np.float64)
+    width = xi[-1] - xi[0]
+    if width == 0:
+        bucket = np.zeros(n, dtype=np.int64)
+    else:
+        bucket = np.minimum(((xi - xi[0]) / width * buckets).astype(np.int64), buckets - 1)
+    starts = np.r_[0, np.flatnonzero(np.diff(bucket)) + 1]
+    lasts = np.r_[starts[1:] - 1, n - 1]
+    segment = np.repeat(np.arange(len(starts)), np.diff(np.r_[starts, n]))
+
+    keep = [starts, lasts]
+    for reduce in (np.minimum, np.maximum):
+        extreme = reduce.reduceat(y, starts)
+        hits = np.flatnonzero(y == extreme[segment])
+        _, first_hit = np.unique(segment[hits], return_index=True)
+        keep.append(hits[first_hit])
+    return np.unique(np.concatenate(keep))
+
+
+def prepare_trend_series(df, start=None, end=None, buckets=TREND_BUCKETS):
+    """Date-sorted, date-filtered and downsampled 'Cost per Trade' series for the trend chart.
+
+    Returns the points to plot and the number of rows in the selected range.
+    """
+    dates = df['Date'].to_numpy()
+    costs = df['Cost per Trade'].to_numpy(dtype=np.float64)
+    if not df['Date'].is_monotonic_increasing:
+        order = np.argsort(dates, kind='stable')
+        dates, costs = dates[order], costs[order]
+    if start is not None or end is not None:
+        lo = np.searchsorted(dates, np.datetime64(start, 'ns'), side='left') if start is not None else 0
+        hi = np.searchsorted(dates, np.datetime64(end, 'ns'), side='right') if end is not None else len(dates)
+        dates, costs = dates[lo:hi], costs[lo:hi]
+    keep = downsample_min_max(dates, costs, buckets)
+    return pd.DataFrame({'Date': dates[keep], 'Cost per Trade': costs[keep]}), len(dates)
+
+
+def daily_trend(cube, start=None, end=None):
+    """Per-day trade count, mean, min and max 'Cost per Trade' from the cube."""
+    daily = cube.groupby('Date').agg(count=('count', 'sum'), total=('total', 'sum'),
+                                     minimum=('minimum', 'min'), maximum=('maximum', 'max')).reset_index()
+    if start is not None:
+        daily = daily[daily['Date'] >= pd.Timestamp(start).floor('D')]
+    if end is not None:
+        daily = daily[daily['Date'] <= pd.Timestamp(end)]
+    return daily.assign(**{'Mean Cost': daily['total'] / daily['count']})
+
+
+def loss_model_parameters(df, frequency_scale=1.0):
+    """Per-category frequency/severity parameters for the loss simulation.
+
+    Loss events per horizon are Poisson with mean ``frequency_scale`` times the
+    category's average Likelihood. Each event's loss is lognormal with mean equal
+    to average Cost per Trade times average Severity, and the shape taken from the
+    coefficient of variation of Cost per Trade.
+    """
+    stats = df.assign(cost=df['Cost per Trade'].astype(np.float64)).groupby('Risk Category', observed=True).agg(
+        trades=('cost', 'size'), likelihood=('Likelihood', 'mean'), severity=('Severity', 'mean'),
+        cost_mean=('cost', 'mean'), cost_std=('cost', 'std'))
+    cv = (stats['cost_std'].fillna(0.0) / stats['cost_mean']).replace([np.inf, -np.inf], 0.0).fillna(0.0)
+    sigma = np.maximum(np.sqrt(np.log1p(cv ** 2)), MIN_LOSS_SIGMA)
+    event_mean = stats['cost_mean'] * stats['severity']
+    return pd.DataFrame({
+        'Trades': stats['trades'],
+        'Events per Horizon': stats['likelihood'] * frequency_scale,
+        'Mean Event Loss': event_mean,
+        'mu': np.log(event_mean.clip(lower=1e-12)) - sigma ** 2 / 2,
+        'sigma': sigma,
+    })
+
+
+def simulate_loss_chunk(seed, scenarios, lam, mu, sigma):
+    """Aggregate loss per scenario and category for one chunk, from its own RNG stream."""
+    rng = np.random.default_rng(seed)
+    counts = rng.poisson(lam, size=(scenarios, len(lam)))
+    cells = np.repeat(np.arange(counts.size), counts.ravel())
+    category = cells % len(lam)
+    severities = rng.lognormal(mu[category], sigma[category])
+    return np.bincount(cells, weights=severities, minlength=counts.size).reshape(scenarios, len(lam)).astype(np.float32)
+
+
+_simulation_pool = None
+_simulation_pool_workers = 0
+_simulation_pool_lock = threading.Lock()
+
+
+def get_simulation_pool(workers):
+    """Process pool shared by all sessions, kept alive so workers are spawned once."""
+    global _simulation_pool, _simulation_pool_workers
+    with _simulation_pool_lock:
+        if _simulation_pool is None or _simulation_pool_workers != workers:
+            if _simulation_pool is not None:
+                _simulation_pool.shutdown(wait=False)
+            # Spawned workers avoid forking the multi-threaded Streamlit server.
+            _simulation_pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+            _simulation_pool_workers = workers
+        return _simulation_pool
+
+
+def discard_simulation_pool(pool):
+    """Drop ``pool`` after a worker died, so the next call spawns a fresh one."""
+    global _simulation_pool, _simulation_pool_workers
+    with _simulation_pool_lock:
+        if _simulation_pool is pool:
+            _simulation_pool = None
+            _simulation_pool_workers = 0
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def _simulate_on_pool(pool, args, parts, job=None):
+    """Fill the missing entries of ``parts`` on ``pool``; ``False`` once cancelled."""
+    futures = {pool.submit(simulate_loss_chunk, *args[i]): i for i, part in enumerate(parts) if part is None}
+    try:
+        for future in as_completed(futures):
+            if job is not None and job.cancelled():
+                return False
+            parts[futures[future]] = future.result()
+            if job is not None:
+                job.report(sum(part is not None for part in parts) / len(parts))
+    finally:
+        for future in futures:
+            future.cancel()
+    return True
+
+
+def simulation_chunk_size(lam, chunk=SIMULATION_CHUNK, event_budget=SIMULATION_EVENT_BUDGET):
+    """Scenarios per chunk so a chunk draws about ``event_budget`` loss events on average."""
+    events = int(np.ceil(lam.sum()))
+    return max(1, min(chunk, event_budget // max(events, 1)))
+
+
+def simulate_operational_losses(params, scenarios, seed=0, workers=None, chunk=SIMULATION_CHUNK, job=None):
+    """Frequency/severity Monte Carlo: ``(scenarios, categories)`` float32 array of losses.
+
+    Scenarios are split into chunks of at most ``chunk`` scenarios and about
+    ``SIMULATION_EVENT_BUDGET`` expected events, so memory per chunk stays flat as
+    the frequency scale grows. Each chunk is seeded from ``SeedSequence(seed).spawn``,
+    so the result depends only on ``seed``, ``chunk`` and the parameters and not
+    on how many worker processes ran them. When run as a ``BackgroundJob`` it reports progress
+    per chunk and returns ``None`` once cancelled, dropping chunks not yet started.
+    If a worker process dies, the shared pool is replaced and the unfinished
+    chunks are retried once.
+    """
+    lam = params['Events per Horizon'].to_numpy(dtype=np.float64)
+    mu = params['mu'].to_numpy(dtype=np.float64)
+    sigma = params['sigma'].to_numpy(dtype=np.float64)
+    chunk = simulation_chunk_size(lam, chunk)
+    sizes = [min(chunk, scenarios - start) for start in range(0, scenarios, chunk)]
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+    workers = min(workers or os.cpu_count() or 1, len(sizes))
+    args = [(chunk_seed, size, lam, mu, sigma) for chunk_seed, size in zip(seeds, sizes)]
+    parts = [None] * len(args)
+    if workers <= 1:
+        for i, chunk_args in enumerate(args):
+            if job is not None and job.cancelled():
+                return None
+            parts[i] = simulate_loss_chunk(*chunk_args)
+            if job is not None:
+                job.report((i + 1) / len(args))
+        return np.concatenate(parts)
+
+    for attempt in range(2):
+        pool = get_simulation_pool(workers)
+        try:
+            if not _simulate_on_pool(pool, args, parts, job):
+                return None
+            return np.concatenate(parts)
+        except BrokenProcessPool:
+            discard_simulation_pool(pool)
+            if attempt:
+                raise
+
+
+def value_at_risk(losses, levels):
+    """Empirical VaR and Expected Shortfall of ``losses`` at each confidence level, from one partition."""
+    n = len(losses)
+    ks = [min(max(int(np.ceil(level * n)) - 1, 0), n - 1) for level in levels]
+    ordered = np.partition(losses, ks)
+    return {level: (float(ordered[k]), float(ordered[k:].mean())) for level, k in zip(levels, ks)}
+
+
+def loss_risk_table(losses, categories, levels):
+    columns = {name: losses[:, i].astype(np.float64) for i, name in enumerate(categories)}
+    columns['Total'] = losses.sum(axis=1, dtype=np.float64)
+    rows = []
+    for name, values in columns.items():
+        row = {'Risk Category': name, 'Expected Loss': values.mean()}
+        for level, (var, es) in value_at_risk(values, levels).items():
+            row[f"VaR {level:.1%}"] = var
+            row[f"ES {level:.1%}"] = es
+        rows.append(row)
+    return pd.DataFrame(rows), columns['Total']
+
+
+def run_loss_simulation(job, df, frequency_scale, scenarios, seed, workers, levels):
+    """Job body for the loss simulation form: the results shown on the page, or ``None`` if cancelled."""
+    params = loss_model_parameters(df, frequency_scale)
+    start = time.perf_counter()
+    with span("Monte Carlo"):
+        losses = simulate_operational_losses(params, scenarios, seed=seed, workers=workers, job=job)
+    if losses is None:
+        return None
+    elapsed = time.perf_counter() - start
+    with span("VaR / ES table"):
+        table, total = loss_risk_table(losses, list(params.index.astype(str)), sorted(levels))
+    counts, edges = np.histogram(total, bins=100)
+    return {
+        'params': params, 'table': table, 'elapsed': elapsed, 'scenarios': scenarios,
+        'histogram': pd.DataFrame({'Loss': (edges[:-1] + edges[1:]) / 2, 'Scenarios': counts}),
+    }
+
+
 def run_analytics_and_visualizations():
     st.header("Analytics and Advanced Visualizations")
     st.markdown(r"""
@@ -18,6 +411,7 @@ This integrated approach enables organizations to move beyond basic reporting to
 """)
 
     # Cost Variability Analysis Section
+    profile_section("Cost variability")
     st.subheader("Cost Variability Analysis")
     st.markdown(r"""
 **Statistical Methodology:**  
@@ -32,69 +426,88 @@ The normalized standard deviation provides a scale-independent measure of cost v
 Where $\sigma_{\text{cost per trade}}$ represents the standard deviation of cost per trade. Higher normalized standard deviation values indicate greater cost variability, warranting investigation and process improvements.
 """)
 
-    def calculate_normalized_std_dev(cost_data):
-        if not isinstance(cost_data, list):
-            cost_data = list(cost_data)
-
-        if not cost_data:
-            raise ValueError("Cost data cannot be empty.")
-
-        if len(cost_data) <= 1:
-            return 0.0
-
-        std_dev = np.std(cost_data)
-        data_range = max(cost_data) - min(cost_data)
-
-        if data_range == 0:
-            return 0.0
-
-        return std_dev / data_range
+    df = load_risklab_frame(ANALYTICS_COLUMNS)
+    cube = load_risklab_cube() if df is not None else None
+    data_key = dataset_identity()
 
-    df = st.session_state.get('risklab_df', None)
+    def parse_manual_costs():
+        manual_cost_input = st.text_input("Enter comma-separated cost data (e.g., 10, 12, 15, 11, 13)", value="10, 12, 15, 11, 13", help="Enter numeric values separated by commas.")
+        try:
+            return np.array([float(x.strip()) for x in manual_cost_input.split(',') if x.strip()])
+        except ValueError:
+            st.error("Invalid input. Please enter numeric values separated by commas.")
+            return np.array([])
 
-    cost_data_to_use = []
+    use_df_data = False
     if df is not None and 'Cost per Trade' in df.columns and not df.empty:
         use_df_data = st.checkbox("Use 'Cost per Trade' from uploaded data", value=True)
-        if use_df_data:
-            cost_data_to_use = df['Cost per Trade'].tolist()
+        if use_df_data and cube is not None:
+            cost_data_to_use = None
+            st.write(f"Using {int(cube['count'].sum())} data points from 'Cost per Trade' column.")
+        elif use_df_data:
+            cost_data_to_use = df['Cost per Trade'].to_numpy()
             st.write(f"Using {len(cost_data_to_use)} data points from 'Cost per Trade' column.")
         else:
-            manual_cost_input = st.text_input("Enter comma-separated cost data (e.g., 10, 12, 15, 11, 13)", value="10, 12, 15, 11, 13", help="Enter numeric values separated by commas.")
-            try:
-                cost_data_to_use = [float(x.strip()) for x in manual_cost_input.split(',') if x.strip()]
-            except ValueError:
-                st.error("Invalid input. Please enter numeric values separated by commas.")
-                cost_data_to_use = []
+            cost_data_to_use = parse_manual_costs()
     else:
         st.info("No valid data loaded yet, please upload a CSV or use the sample data to enable analysis.")
-        manual_cost_input = st.text_input("Enter comma-separated cost data (e.g., 10, 12, 15, 11, 13)", value="10, 12, 15, 11, 13", help="Enter numeric values separated by commas.")
-        try:
-            cost_data_to_use = [float(x.strip()) for x in manual_cost_input.split(',') if x.strip()]
-        except ValueError:
-            st.error("Invalid input. Please enter numeric values separated by commas.")
-            cost_data_to_use = []
+        cost_data_to_use = parse_manual_costs()
 
-    if cost_data_to_use:
+    if cost_data_to_use is None or len(cost_data_to_use):
         try:
-            normalized_std_dev = calculate_normalized_std_dev(cost_data_to_use)
+            variability = cube_variability(cube) if cost_data_to_use is None else cost_variability(cost_data_to_use)
             
             col1, col2, col3 = st.columns(3)
             with col1:
-                st.metric(label="Normalized Std Dev", value=f"{normalized_std_dev:.4f}")
+                st.metric(label="Normalized Std Dev", value=f"{variability['normalized_std']:.4f}")
             with col2:
-                st.metric(label="Standard Deviation", value=f"{np.std(cost_data_to_use):.2f}")
+                st.metric(label="Standard Deviation", value=f"{variability['std']:.2f}")
             with col3:
-                st.metric(label="Mean Cost", value=f"{np.mean(cost_data_to_use):.2f}")
+                st.metric(label="Mean Cost", value=f"{variability['mean']:.2f}")
                 
         except ValueError as e:
             st.error(e)
     else:
         st.warning("No cost data available for calculation.")
 
+    # Each fragment below reruns on its own when its widgets change, without
+    # reloading the dataset or redrawing the other sections.
+    @st.fragment
+    def variability_by_segment():
+        st.markdown("**Variability by Segment and Period:**")
+        col1, col2, col3 = st.columns(3)
+        with col1:
+            group_by = st.multiselect("Group by", ['Risk Category', 'Firm Type'], default=['Risk Category'])
+        with col2:
+            window = st.selectbox("Time window", ['None', *VARIABILITY_WINDOWS], index=2)
+        with col3:
+            rolling = st.number_input("Trailing windows", min_value=1, max_value=52, value=1,
+                                      help="Number of consecutive time windows, ending at each row's window, combined into it; windows without trades still count (1 = non-overlapping windows).",
+                                      disabled=window == 'None')
+        try:
+            freq = VARIABILITY_WINDOWS.get(window)
+            variability_table = run_in_background('variability', (data_key, tuple(group_by), freq, int(rolling)),
+                                                  "Computing variability", grouped_cost_variability, df, group_by, freq, int(rolling), cube)
+            if freq is not None and not variability_table.empty:
+                fig_variability = px.line(variability_table, x='Date', y='Normalized Std Dev',
+                                          color=variability_table[group_by].astype(str).agg(' / '.join, axis=1) if group_by else None,
+                                          markers=True, title=f"Normalized Std Dev per {window.lower()}",
+                                          labels={"color": " / ".join(group_by)})
+                fig_variability.update_layout(height=350)
+                st.plotly_chart(fig_variability, use_container_width=True)
+            st.dataframe(variability_table, hide_index=True)
+        except Exception as e:
+            st.error(f"Error computing grouped variability: {e}")
+
+    profile_section("Variability by segment")
+    if use_df_data:
+        variability_by_segment()
+
     # Add separator
     st.markdown("---")
 
     # Visualization Section
+    profile_section("Trend chart")
     st.subheader("Temporal and Categorical Visualizations")
 
     if df is not None and not df.empty:
@@ -104,26 +517,72 @@ Where $\sigma_{\text{cost per trade}}$ represents the standard deviation of cost
 Understanding the evolution of key metrics over time is crucial for identifying patterns, cycles, and anomalies in operational risk. This visualization tracks cost per trade trends, enabling detection of increasing costs, periods of volatility, and operational efficiency changes. Temporal analysis supports predictive modeling and early warning system development for proactive risk management.
 """)
         
-        try:
-            df_sorted = df.sort_values(by='Date')
-            fig_trend = px.line(df_sorted, x='Date', y='Cost per Trade',
-                                title="Cost per Trade Trend Over Time",
-                                labels={"Date": "Date", "Cost per Trade": "Cost per Trade"})
-            fig_trend.update_layout(height=400)
-            st.plotly_chart(fig_trend, use_container_width=True)
-        except Exception as e:
-            st.error(f"Error creating time-based trend plot: {e}")
+        @st.fragment
+        def trend_chart():
+            try:
+                if cube is not None:
+                    # Cube dates are day buckets; the last bucket extends to the end of its day.
+                    first_date = cube['Date'].min().to_pydatetime()
+                    last_date = (cube['Date'].max() + pd.Timedelta(days=1)).to_pydatetime()
+                else:
+                    first_date, last_date = df['Date'].min().to_pydatetime(), df['Date'].max().to_pydatetime()
+                trend_view = 'Individual trades'
+                if cube is not None:
+                    trend_view = st.radio("Trend view", ['Daily aggregates', 'Individual trades'], horizontal=True,
+                                          help="Daily aggregates are served from the pre-aggregated cube; individual trades are downsampled from the rows.")
+                col1, col2 = st.columns([3, 1])
+                with col1:
+                    if first_date < last_date:
+                        start, end = st.slider("Zoom to date range", min_value=first_date, max_value=last_date,
+                                               value=(first_date, last_date), format="YYYY-MM-DD",
+                                               help="Narrowing the range redraws the chart at full resolution for that period.")
+                    else:
+                        start, end = first_date, last_date
+                if trend_view == 'Daily aggregates':
+                    daily = daily_trend(cube, start, end)
+                    fig_trend = px.line(daily, x='Date', y='Mean Cost',
+                                        title="Cost per Trade Trend Over Time (daily mean, min-max band)",
+                                        labels={"Date": "Date", "Mean Cost": "Cost per Trade"})
+                    fig_trend.add_scatter(x=daily['Date'], y=daily['maximum'], mode='lines', line_width=0,
+                                          name='Daily max', showlegend=False)
+                    fig_trend.add_scatter(x=daily['Date'], y=daily['minimum'], mode='lines', line_width=0,
+                                          fill='tonexty', fillcolor='rgba(31, 119, 180, 0.2)', name='Daily min', showlegend=False)
+                    fig_trend.update_layout(height=400)
+                    st.plotly_chart(fig_trend, use_container_width=True)
+                else:
+                    with col2:
+                        buckets = st.number_input("Chart resolution (buckets)", min_value=100, max_value=10000, value=TREND_BUCKETS, step=100,
+                                                  help="Each bucket keeps its first, last, lowest and highest cost, so spikes are never dropped.")
+                    trend_points, trend_rows = run_in_background('trend', (data_key, start, end, int(buckets)), "Preparing trend chart",
+                                                                 prepare_trend_series, df, start, end, int(buckets))
+                    fig_trend = px.line(trend_points, x='Date', y='Cost per Trade',
+                                        title="Cost per Trade Trend Over Time",
+                                        labels={"Date": "Date", "Cost per Trade": "Cost per Trade"},
+                                        render_mode='webgl' if len(trend_points) > WEBGL_MIN_POINTS else 'svg')
+                    fig_trend.update_layout(height=400)
+                    st.plotly_chart(fig_trend, use_container_width=True)
+                    if len(trend_points) < trend_rows:
+                        st.caption(f"Showing {len(trend_points):,} of {trend_rows:,} points (min/max per bucket).")
+            except Exception as e:
+                st.error(f"Error creating time-based trend plot: {e}")
+
+        trend_chart()
 
         st.markdown("---")
 
         # Categorical Analysis
+        profile_section("Category chart")
         st.markdown("**Categorical Risk Intelligence:**")
         st.markdown("""
 Categorical analysis identifies which operational segments exhibit higher risk profiles or cost inefficiencies by comparing severity levels across different risk categories. This visualization reveals inherent risks associated with specific operational areas, enabling targeted risk management strategies and resource optimization. The segmented approach helps prioritize mitigation efforts and allocate resources to the most critical risk categories.
 """)
         
         try:
-            avg_severity_by_category = df.groupby('Risk Category')['Severity'].mean().reset_index()
+            if cube is not None:
+                severity_totals = cube.groupby('Risk Category')[['severity_total', 'count']].sum()
+                avg_severity_by_category = (severity_totals['severity_total'] / severity_totals['count']).rename('Severity').reset_index()
+            else:
+                avg_severity_by_category = df.groupby('Risk Category', observed=True)['Severity'].mean().reset_index()
             fig_category = px.bar(avg_severity_by_category, x='Risk Category', y='Severity',
                                    title="Average Severity Across Risk Categories",
                                    labels={"Risk Category": "Risk Category", "Severity": "Average Severity"},
@@ -134,3 +593,58 @@ Categorical analysis identifies which operational segments exhibit higher risk p
         except Exception as e:
             st.error(f"Error creating categorical insights plot: {e}")
 
+        st.markdown("---")
+
+        # Operational Loss Simulation
+        profile_section("Loss simulation")
+        st.subheader("Operational Loss Simulation (VaR / Expected Shortfall)")
+        st.markdown(r"""
+A frequency/severity Monte Carlo turns the Severity and Likelihood scores into a loss distribution per risk category. In each scenario, the number of loss events in a category is Poisson with mean equal to its average Likelihood times the frequency scale. Each event's loss is lognormal, with mean equal to the category's average Cost per Trade times its average Severity and with a spread taken from the variability of Cost per Trade. Value-at-Risk is the loss quantile at the chosen confidence level; Expected Shortfall is the average loss beyond it.
+""")
+        @st.fragment
+        def loss_simulation():
+            with st.form("loss_simulation"):
+                col1, col2, col3, col4 = st.columns(4)
+                with col1:
+                    scenarios = st.number_input("Scenarios", min_value=10_000, max_value=10_000_000, value=200_000, step=10_000)
+                with col2:
+                    frequency_scale = st.number_input("Frequency scale", min_value=0.01, max_value=100.0, value=1.0, step=0.1,
+                                                      help="Loss events per horizon for each point of average Likelihood.")
+                with col3:
+                    seed = st.number_input("Random seed", min_value=0, value=42, step=1)
+                with col4:
+                    workers = st.number_input("Worker processes", min_value=1, max_value=os.cpu_count() or 1, value=os.cpu_count() or 1)
+                levels = st.multiselect("Confidence levels", VAR_LEVELS, default=[0.95, 0.99], format_func=lambda level: f"{level:.1%}")
+                submitted = st.form_submit_button("Run Simulation", type="primary")
+
+            if submitted and levels:
+                start_job('simulation', (data_key, frequency_scale, int(scenarios), int(seed), int(workers), tuple(levels)),
+                          run_loss_simulation, df, frequency_scale, int(scenarios), int(seed), int(workers), levels)
+
+            # The job outlives reruns started elsewhere on the page; its result is picked up here.
+            # Results are tagged with the dataset they came from and dropped once it changes.
+            job = session_jobs().get('simulation')
+            if job is not None and job.key[0] != data_key:
+                session_jobs().pop('simulation').cancel()
+            elif job is not None:
+                try:
+                    result = wait_for_job(job, "Simulating losses")
+                    if result is not None:
+                        st.session_state['risklab_loss_simulation'] = {**result, 'data_key': data_key}
+                except Exception as e:
+                    st.error(f"Error running loss simulation: {e}")
+                session_jobs().pop('simulation', None)
+
+            simulation = st.session_state.get('risklab_loss_simulation')
+            if simulation is not None and simulation['data_key'] != data_key:
+                del st.session_state['risklab_loss_simulation']
+                st.info("The dataset changed since the last simulation; run it again for the current data.")
+            elif simulation is not None:
+                st.caption(f"{simulation['scenarios']:,} scenarios in {simulation['elapsed']:.2f} s.")
+                st.dataframe(simulation['params'].drop(columns=['mu', 'sigma']).style.format({'Events per Horizon': '{:.2f}', 'Mean Event Loss': '{:,.2f}'}))
+                st.dataframe(simulation['table'].style.format({col: '{:,.2f}' for col in simulation['table'].columns if col != 'Risk Category'}), hide_index=True)
+                fig_losses = px.bar(simulation['histogram'], x='Loss', y='Scenarios', title="Distribution of Total Loss per Horizon")
+                fig_losses.update_layout(height=350, bargap=0)
+                st.plotly_chart(fig_losses, use_container_width=True)
+
+        loss_simulation()
@@ -0,0 +1,59 @@
+import threading
+from collections import OrderedDict
+
+
+class LRUCache:
+    """Thread-safe LRU cache bounded by entry count and by the byte size callers report.
+
+    Instances are module-level and shared by every session of the server, so cached
+    values (parsed frames, rendered figures) must be treated as read-only.
+    """
+
+    def __init__(self, max_entries=8, max_bytes=2 * 1024 ** 3):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._sizes = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, key, entry, nbytes):
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                return self._entries[key]
+            # An entry larger than the whole budget is returned to the caller but never stored.
+            if nbytes > self.max_bytes:
+                return entry
+            self._entries[key] = entry
+            self._sizes[key] = nbytes
+            while len(self._entries) > self.max_entries or self.total_bytes() > self.max_bytes:
+                old_key, _ = self._entries.popitem(last=False)
+                del self._sizes[old_key]
+                self.evictions += 1
+            return entry
+
+    def total_bytes(self):
+        return sum(self._sizes.values())
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'bytes': self.total_bytes(),
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+            }
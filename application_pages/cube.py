@@ -0,0 +1,51 @@
+import numpy as np
+import pandas as pd
+
+# Aggregate cube: one row per Risk Category x Firm Type x day.
+CUBE_KEYS = ['Risk Category', 'Firm Type', 'Date']
+# Measures merged by plain aggregation; 'm2' (squared deviations about the cell mean) is merged with Chan's formula.
+CUBE_MEASURES = {'count': 'sum', 'total': 'sum', 'minimum': 'min', 'maximum': 'max', 'severity_total': 'sum'}
+
+
+def build_cube(df):
+    """Pre-aggregate a validated frame by Risk Category x Firm Type x day.
+
+    Each cell holds the trade count, the sum, the sum of squared deviations from
+    the cell mean (``m2``), min and max of 'Cost per Trade' and the Severity total,
+    which is enough to serve the analytics page without touching rows. Keeping
+    ``m2`` rather than a raw sum of squares keeps the variance exact for costs with
+    a large mean and a small spread.
+    """
+    cost = df['Cost per Trade'].to_numpy(dtype=np.float64)
+    frame = pd.DataFrame({
+        'Risk Category': df['Risk Category'],
+        'Firm Type': df['Firm Type'],
+        'Date': df['Date'].dt.floor('D'),
+        'cost': cost,
+        'severity': df['Severity'].to_numpy(dtype=np.float64),
+    }, index=df.index)
+    frame['deviation_sq'] = (frame['cost'] - frame.groupby(CUBE_KEYS, observed=True)['cost'].transform('mean')) ** 2
+    cube = frame.groupby(CUBE_KEYS, observed=True).agg(
+        count=('cost', 'size'), total=('cost', 'sum'), m2=('deviation_sq', 'sum'),
+        minimum=('cost', 'min'), maximum=('cost', 'max'), severity_total=('severity', 'sum')).reset_index()
+    # Plain strings keep cubes from different uploads mergeable.
+    for col in ('Risk Category', 'Firm Type'):
+        cube[col] = cube[col].astype(str)
+    return cube
+
+
+def merge_cubes(*cubes):
+    """Combine cubes cell by cell; ``m2`` is merged like ``RunningMoments.merge``."""
+    cubes = [cube for cube in cubes if cube is not None]
+    if len(cubes) == 1:
+        return cubes[0]
+    cells = pd.concat(cubes, ignore_index=True)
+    grouped = cells.groupby(CUBE_KEYS)
+    merged_mean = grouped['total'].transform('sum') / grouped['count'].transform('sum')
+    cells['m2'] = cells['m2'] + cells['count'] * (cells['total'] / cells['count'] - merged_mean) ** 2
+    return cells.groupby(CUBE_KEYS).agg({**CUBE_MEASURES, 'm2': 'sum'}).reset_index()[cubes[0].columns]
+
+
+def update_cube(cube, new_rows):
+    """Fold newly validated rows into an existing cube; costs O(new rows + groups)."""
+    return merge_cubes(cube, build_cube(new_rows))
@@ -1,7 +1,815 @@
+import hashlib
+import os
+import time
+import uuid
+from io import BytesIO, StringIO
+
 import streamlit as st
 import pandas as pd
 import numpy as np
 import matplotlib.pyplot as plt
+import pyarrow as pa
+
+from application_pages.caching import LRUCache
+from application_pages.cube import build_cube, update_cube
+from application_pages.datasets import DATASET_MAX_COUNT, delete_dataset, list_datasets, open_dataset, save_dataset
+from application_pages.figures import render_figure_stats, show_figure
+from application_pages.jobs import cancel_jobs, start_job, wait_for_job
+from application_pages.profiling import profile_section, span
+
+REQUIRED_COLUMNS = ['Date', 'Cost per Trade', 'Trade ID', 'Risk Category', 'Severity', 'Likelihood', 'Firm Type']
+SCALE_COLUMNS = ['Severity', 'Likelihood']
+# String columns with at most this share of distinct values are stored as categoricals.
+CATEGORICAL_MAX_RATIO = 0.5
+# Quarantined rows kept for download; rows beyond this are counted but not stored.
+QUARANTINE_MAX_ROWS = 100_000
+
+# Peer benchmarking: score dimensions, percentiles drawn as bands, and peers listed as nearest.
+SCORE_COLUMNS = ['Output', 'Process', 'Audience', 'Success']
+BENCHMARK_BAND_PERCENTILES = [0, 10, 25, 50, 75, 90, 100]
+NEAREST_PEERS = 10
+
+# Streaming ingestion: rows parsed per chunk and rows kept as the in-memory sample.
+STREAM_CHUNK_ROWS = 250_000
+STREAM_SAMPLE_ROWS = 200_000
+# Progress of a full (non-streaming) upload after each step, roughly by its share of the time.
+UPLOAD_PROGRESS = {'read_csv': 0.5, 'validate rows': 0.7, 'describe': 0.75, 'compact': 0.85, 'build cube': 0.95}
+
+
+_parsed_upload_cache = LRUCache()
+# Parsed peer benchmark tables; kept apart so they never evict parsed uploads or
+# count toward the upload cache's hit rate.
+_benchmark_cache = LRUCache(max_entries=8, max_bytes=256 * 1024 ** 2)
+
+
+def get_parsed_upload_cache():
+    return _parsed_upload_cache
+
+
+def content_hash(raw_bytes):
+    return hashlib.blake2b(raw_bytes, digest_size=20).hexdigest()
+
+
+def upload_hash(uploaded_file):
+    # getbuffer() hashes the upload in place instead of copying it like getvalue().
+    with uploaded_file.getbuffer() as buf:
+        return content_hash(buf)
+
+
+def sample_data():
+    data = {
+        'Date': ['2024-01-01', '2024-01-02', '2024-01-03', '2024-01-04', '2024-01-05'],
+        'Cost per Trade': [10.5, 12.3, 11.0, 14.8, 9.7],
+        'Trade ID': [101, 102, 103, 104, 105],
+        'Risk Category': ['Market', 'Operational', 'Credit', 'Market', 'Operational'],
+        'Severity': [5, 7, 4, 6, 8],
+        'Likelihood': [6, 8, 3, 7, 9],
+        'Firm Type': ['A', 'B', 'A', 'B', 'A']
+    }
+    return pd.DataFrame(data)
+
+
+def missing_column_error(df):
+    for col in REQUIRED_COLUMNS:
+        if col not in df.columns:
+            return f"Missing required column: `{col}`. Please ensure your CSV has all required columns."
+    return None
+
+
+def validate_rows(df, row_offset=0):
+    """Coerce the required columns once and split rows into valid and quarantined.
+
+    Every check is a vectorized boolean mask over the whole frame: missing values,
+    values that fail type coercion, and Severity/Likelihood that are not whole
+    numbers from 1 to 10. Returns ``(valid_df, quarantine_df, has_missing)``; the
+    quarantine keeps the raw values plus the 1-based data ``Row`` and ``Reasons``.
+    """
+    coerced = {
+        'Date': pd.to_datetime(df['Date'], errors='coerce'),
+        'Cost per Trade': pd.to_numeric(df['Cost per Trade'], errors='coerce'),
+        'Trade ID': pd.to_numeric(df['Trade ID'], errors='coerce'),
+        'Severity': pd.to_numeric(df['Severity'], errors='coerce'),
+        'Likelihood': pd.to_numeric(df['Likelihood'], errors='coerce'),
+    }
+
+    reasons = {}
+    has_missing = False
+    for col in REQUIRED_COLUMNS:
+        missing = df[col].isna().to_numpy()
+        has_missing = has_missing or bool(missing.any())
+        reasons[f"missing {col}"] = missing
+        if col in coerced:
+            reasons[f"invalid {col}"] = coerced[col].isna().to_numpy() & ~missing
+    for col in SCALE_COLUMNS:
+        values = coerced[col].to_numpy(dtype=np.float64, na_value=np.nan)
+        with np.errstate(invalid='ignore'):
+            reasons[f"{col} not an integer from 1 to 10"] = ~np.isnan(values) & ((values < 1) | (values > 10) | (values != np.floor(values)))
+    bad = np.logical_or.reduce(list(reasons.values()))
+
+    quarantine = None
+    if bad.any():
+        labels = np.full(int(bad.sum()), '', dtype=object)
+        for label, mask in reasons.items():
+            hit = mask[bad]
+            if hit.any():
+                labels[hit] = labels[hit] + (label + '; ')
+        quarantine = df.loc[bad].copy()
+        quarantine.insert(0, 'Row', np.flatnonzero(bad) + row_offset + 1)
+        quarantine['Reasons'] = pd.Series(labels, index=quarantine.index).str.rstrip('; ')
+
+    valid = df.loc[~bad] if bad.any() else df
+    valid = valid.assign(**{col: series[~bad] if bad.any() else series for col, series in coerced.items()})
+    for col in ('Trade ID', *SCALE_COLUMNS):
+        valid[col] = pd.to_numeric(valid[col], downcast='integer')
+    return valid.reset_index(drop=True), quarantine, has_missing
+
+
+def quarantine_entry(quarantine, quarantined_rows):
+    return {
+        'quarantine': quarantine,
+        'quarantined_rows': quarantined_rows,
+        'quarantine_csv': quarantine.to_csv(index=False).encode('utf-8') if quarantine is not None else None,
+    }
+
+
+def cancelled_entry():
+    return {'df': None, 'error': "Parsing was cancelled.", 'cancelled': True}
+
+
+def parse_and_validate(source, job=None):
+    """Parse a CSV source and validate it, without touching the page.
+
+    Returns a dict with the validated frame (or ``None``) under ``'df'``, an error
+    message under ``'error'``, the precomputed ``'description'`` and
+    ``'has_missing'`` used by the Data Description section, and the quarantined rows.
+    When run as a ``BackgroundJob`` it reports progress after each step, stops
+    between steps once cancelled and returns ``cancelled_entry()``. ``read_csv`` itself cannot be interrupted, so a
+    cancel during the read only takes effect once the whole file is parsed.
+    """
+    if isinstance(source, pd.DataFrame):
+        df = source
+    else:
+        try:
+            with span("read_csv"):
+                df = pd.read_csv(source)
+        except Exception as e:
+            return {'df': None, 'error': f"Error loading file: {e}. Please ensure it's a valid CSV."}
+    if job is not None:
+        if job.cancelled():
+            return cancelled_entry()
+        job.report(UPLOAD_PROGRESS['read_csv'])
+
+    error = missing_column_error(df)
+    if error is not None:
+        return {'df': None, 'error': error}
+
+    with span("validate rows"):
+        df, quarantine, has_missing = validate_rows(df)
+    if job is not None:
+        if job.cancelled():
+            return cancelled_entry()
+        job.report(UPLOAD_PROGRESS['validate rows'])
+    # Only describe numeric columns to avoid Arrow serialization issues with datetime
+    numeric_cols = df.select_dtypes(include=[np.number]).columns
+    with span("describe"):
+        description = df[numeric_cols].describe() if len(numeric_cols) > 0 and not df.empty else None
+    if job is not None:
+        job.report(UPLOAD_PROGRESS['describe'])
+    quarantined_rows = 0 if quarantine is None else len(quarantine)
+    if quarantine is not None and quarantined_rows > QUARANTINE_MAX_ROWS:
+        quarantine = quarantine.iloc[:QUARANTINE_MAX_ROWS]
+    return {
+        'df': df,
+        'error': None,
+        'description': description,
+        'has_missing': has_missing,
+        **quarantine_entry(quarantine, quarantined_rows),
+    }
+
+
+class RunningMoments:
+    """Count, mean, sum of squared deviations, min and max, mergeable across chunks (Chan et al.)."""
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = np.inf
+        self.max = -np.inf
+
+    def update(self, values):
+        values = values[~np.isnan(values)]
+        if values.size == 0:
+            return
+        other = RunningMoments()
+        other.count = values.size
+        other.mean = float(values.mean())
+        other.m2 = float(((values - other.mean) ** 2).sum())
+        other.min = float(values.min())
+        other.max = float(values.max())
+        self.merge(other)
+
+    def merge(self, other):
+        if other.count == 0:
+            return
+        total = self.count + other.count
+        delta = other.mean - self.mean
+        self.m2 += other.m2 + delta ** 2 * self.count * other.count / total
+        self.mean += delta * other.count / total
+        self.count = total
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+
+    def std(self):
+        # Sample standard deviation, matching DataFrame.describe().
+        return float(np.sqrt(self.m2 / (self.count - 1))) if self.count > 1 else np.nan
+
+
+class QuantileSketch:
+    """Mergeable quantile sketch with relative accuracy ``alpha`` (DDSketch-style log buckets)."""
+
+    def __init__(self, alpha=0.01):
+        self.alpha = alpha
+        self.gamma = (1 + alpha) / (1 - alpha)
+        self._log_gamma = np.log(self.gamma)
+        self.positive = {}
+        self.negative = {}
+        self.zeros = 0
+        self.count = 0
+
+    def _add_buckets(self, store, magnitudes):
+        keys, counts = np.unique(np.ceil(np.log(magnitudes) / self._log_gamma).astype(np.int64), return_counts=True)
+        for key, count in zip(keys.tolist(), counts.tolist()):
+            store[key] = store.get(key, 0) + count
+
+    def update(self, values):
+        values = values[~np.isnan(values)]
+        if values.size == 0:
+            return
+        self.count += values.size
+        self.zeros += int(np.count_nonzero(values == 0))
+        if (values > 0).any():
+            self._add_buckets(self.positive, values[values > 0])
+        if (values < 0).any():
+            self._add_buckets(self.negative, -values[values < 0])
+
+    def merge(self, other):
+        for store, other_store in ((self.positive, other.positive), (self.negative, other.negative)):
+            for key, count in other_store.items():
+                store[key] = store.get(key, 0) + count
+        self.zeros += other.zeros
+        self.count += other.count
+
+    def _bucket_value(self, key):
+        return 2 * self.gamma ** key / (self.gamma + 1)
+
+    def quantile(self, q):
+        if self.count == 0:
+            return np.nan
+        rank = q * (self.count - 1)
+        seen = 0
+        for key in sorted(self.negative, reverse=True):
+            seen += self.negative[key]
+            if seen > rank:
+                return -self._bucket_value(key)
+        seen += self.zeros
+        if seen > rank:
+            return 0.0
+        for key in sorted(self.positive):
+            seen += self.positive[key]
+            if seen > rank:
+                return self._bucket_value(key)
+        return self._bucket_value(max(self.positive)) if self.positive else 0.0
+
+
+class ColumnSummary:
+    def __init__(self):
+        self.moments = RunningMoments()
+        self.sketch = QuantileSketch()
+
+    def update(self, series):
+        values = pd.to_numeric(series, errors='coerce').to_numpy(dtype=np.float64, na_value=np.nan)
+        self.moments.update(values)
+        self.sketch.update(values)
+
+    def describe(self):
+        m = self.moments
+        # Clamp sketch estimates to the exact extremes so small columns stay sensible.
+        quantiles = [float(np.clip(self.sketch.quantile(q), m.min, m.max)) if m.count else np.nan for q in (0.25, 0.5, 0.75)]
+        return pd.Series(
+            [m.count, m.mean if m.count else np.nan, m.std(), m.min if m.count else np.nan, *quantiles, m.max if m.count else np.nan],
+            index=['count', 'mean', 'std', 'min', '25%', '50%', '75%', 'max'],
+            dtype=np.float64,
+        )
+
+
+def stream_and_validate(source, chunk_rows=STREAM_CHUNK_ROWS, sample_rows=STREAM_SAMPLE_ROWS, seed=0, job=None):
+    """Validate a CSV chunk by chunk in bounded memory.
+
+    Each chunk is checked with ``validate_rows`` and its valid rows are folded into
+    one-pass column summaries; failing rows go to the quarantine. Only a uniform random sample of ``sample_rows`` rows is kept (bottom-k
+    random keys), which is what the downstream pages receive as the dataset. The
+    returned dict has the same shape as ``parse_and_validate`` plus ``'rows'``.
+    When run as a ``BackgroundJob`` it reports progress and stops between chunks
+    once cancelled, returning an entry with ``'cancelled'`` set.
+    """
+    size = None
+    if hasattr(source, 'seek'):
+        size = source.seek(0, os.SEEK_END)
+        source.seek(0)
+    rng = np.random.default_rng(seed)
+    summaries = {}
+    has_missing = False
+    rows = 0
+    quarantined = []
+    quarantined_rows = 0
+    cube = None
+    sample = None
+    sample_keys = np.empty(0)
+    try:
+        with pd.read_csv(source, chunksize=chunk_rows) as reader:
+            for chunk in reader:
+                if job is not None:
+                    if job.cancelled():
+                        return cancelled_entry()
+                    if size:
+                        job.report(source.tell() / size)
+                error = missing_column_error(chunk)
+                if error is not None:
+                    return {'df': None, 'error': error}
+                raw_rows = len(chunk)
+                chunk, chunk_quarantine, chunk_missing = validate_rows(chunk, row_offset=rows)
+                if chunk_quarantine is not None:
+                    room = QUARANTINE_MAX_ROWS - sum(len(q) for q in quarantined)
+                    if room > 0:
+                        quarantined.append(chunk_quarantine.iloc[:room])
+                    quarantined_rows += len(chunk_quarantine)
+
+                if not summaries:
+                    numeric_cols = chunk.select_dtypes(include=[np.number]).columns
+                    summaries = {col: ColumnSummary() for col in numeric_cols}
+                for col, summary in summaries.items():
+                    summary.update(chunk[col])
+                has_missing = has_missing or chunk_missing
+                rows += raw_rows
+                if not chunk.empty:
+                    cube = update_cube(cube, chunk)
+
+                keys = rng.random(len(chunk))
+                if sample is None:
+                    sample, sample_keys = chunk, keys
+                else:
+                    sample = pd.concat([sample, chunk], ignore_index=True)
+                    sample_keys = np.concatenate([sample_keys, keys])
+                if len(sample) > sample_rows:
+                    keep = np.sort(np.argpartition(sample_keys, sample_rows)[:sample_rows])
+                    sample = sample.iloc[keep].reset_index(drop=True)
+                    sample_keys = sample_keys[keep]
+    except Exception as e:
+        return {'df': None, 'error': f"Error loading file: {e}. Please ensure it's a valid CSV."}
+
+    if sample is None:
+        return {'df': None, 'error': "Error loading file: no rows found. Please ensure it's a valid CSV."}
+
+    description = pd.DataFrame({col: summary.describe() for col, summary in summaries.items()}) if summaries else None
+    quarantine = pd.concat(quarantined, ignore_index=True) if quarantined else None
+    return {
+        'df': sample.sort_values('Date', kind='stable').reset_index(drop=True),
+        'error': None,
+        'description': description,
+        'has_missing': has_missing,
+        'rows': rows,
+        'cube': cube,
+        **quarantine_entry(quarantine, quarantined_rows),
+    }
+
+
+def _decimal_places(values, max_decimals=6):
+    for decimals in range(max_decimals + 1):
+        if np.array_equal(np.round(values, decimals), values, equal_nan=True):
+            return decimals
+    return None
+
+
+def compact_column(series):
+    """Return the smallest dtype for ``series`` that loses no information.
+
+    Floats move to float32 only if every value round-trips at the column's decimal
+    precision (e.g. two-decimal prices below ~10^5), i.e. the values written in the
+    CSV are recovered exactly.
+    """
+    if pd.api.types.is_bool_dtype(series) or pd.api.types.is_datetime64_any_dtype(series):
+        return series
+    if pd.api.types.is_integer_dtype(series):
+        return pd.to_numeric(series, downcast='integer')
+    if pd.api.types.is_float_dtype(series):
+        values = series.to_numpy(dtype=np.float64)
+        decimals = _decimal_places(values)
+        if decimals is not None:
+            narrowed = values.astype(np.float32)
+            if np.array_equal(np.round(narrowed.astype(np.float64), decimals), values, equal_nan=True):
+                return pd.Series(narrowed, index=series.index, name=series.name)
+        return series
+    if (pd.api.types.is_object_dtype(series) or pd.api.types.is_string_dtype(series)) and len(series):
+        if series.nunique(dropna=True) <= CATEGORICAL_MAX_RATIO * len(series):
+            return series.astype('category')
+    return series
+
+
+def compact_frame(df):
+    """Shrink a validated frame for storage and report per-column bytes before and after."""
+    before = df.memory_usage(deep=True, index=False)
+    compact = df.assign(**{col: compact_column(df[col]) for col in df.columns})
+    # Validation guarantees whole numbers from 1 to 10 on the risk scales.
+    for col in SCALE_COLUMNS:
+        compact[col] = compact[col].astype(np.int8)
+    after = compact.memory_usage(deep=True, index=False)
+    report = pd.DataFrame({
+        'Column': df.columns,
+        'Type before': df.dtypes.astype(str).values,
+        'Type after': compact.dtypes.astype(str).values,
+        'Bytes before': before.values,
+        'Bytes after': after.values,
+    })
+    return compact, report
+
+
+class TradeIdIndex:
+    """Set of seen Trade IDs kept as a list of hash-indexed segments.
+
+    Each appended batch adds one ``pd.Index`` segment, so appending never rehashes
+    the history; lookups probe every segment's hash table. Segments are merged
+    once there are more than ``max_segments``.
+    """
+
+    def __init__(self, max_segments=32):
+        self.max_segments = max_segments
+        self.segments = []
+
+    def __len__(self):
+        return sum(len(segment) for segment in self.segments)
+
+    def contains(self, ids):
+        seen = np.zeros(len(ids), dtype=bool)
+        for segment in self.segments:
+            seen |= segment.get_indexer(ids) >= 0
+        return seen
+
+    def add(self, ids):
+        self.segments.append(pd.Index(ids))
+        if len(self.segments) > self.max_segments:
+            self.segments = [pd.Index(np.concatenate([segment.to_numpy() for segment in self.segments]))]
+
+
+def concat_frames(frames):
+    """Concatenate batches, keeping categorical columns categorical across differing categories."""
+    if len(frames) == 1:
+        return frames[0]
+    frames = list(frames)
+    for col in frames[0].columns:
+        if all(isinstance(frame[col].dtype, pd.CategoricalDtype) for frame in frames):
+            categories = pd.api.types.union_categoricals([frame[col] for frame in frames]).categories
+            frames = [frame.assign(**{col: frame[col].cat.set_categories(categories)}) for frame in frames]
+    return pd.concat(frames, ignore_index=True)
+
+
+class AppendedDataset:
+    """A dataset grown batch by batch from separately validated uploads.
+
+    Appending costs time proportional to the batch: duplicate Trade IDs are
+    dropped through ``TradeIdIndex``, and the cube and the column summaries are
+    updated from the new rows only. The batches are concatenated lazily, the
+    first time a page asks for the rows after an append.
+    """
+
+    def __init__(self):
+        self.batches = []
+        self.batch_keys = set()
+        self.trade_ids = TradeIdIndex()
+        self.cube = None
+        self.summaries = {}
+        self.rows = 0
+        self._frame = None
+        # Identity for results computed from this dataset; ``version`` changes with every batch.
+        self.uid = uuid.uuid4().hex
+        self.version = 0
+
+    def append(self, key, df):
+        """Merge a validated batch; returns ``(added, duplicates)`` or ``None`` if ``key`` was already appended."""
+        if key in self.batch_keys:
+            return None
+        ids = df['Trade ID'].to_numpy()
+        new = ~pd.Index(ids).duplicated(keep='first') & ~self.trade_ids.contains(ids)
+        batch = df if new.all() else df.loc[new].reset_index(drop=True)
+        self.batch_keys.add(key)
+        if not batch.empty:
+            self.trade_ids.add(batch['Trade ID'].to_numpy())
+            self.batches.append(batch)
+            self.cube = update_cube(self.cube, batch)
+            if not self.summaries:
+                self.summaries = {col: ColumnSummary() for col in batch.select_dtypes(include=[np.number]).columns}
+            for col, summary in self.summaries.items():
+                summary.update(batch[col])
+            self.rows += len(batch)
+            self._frame = None
+            self.version += 1
+        return len(batch), len(df) - len(batch)
+
+    def frame(self):
+        if self._frame is None and self.batches:
+            self._frame = concat_frames(self.batches)
+            self.batches = [self._frame]
+        return self._frame
+
+    def describe(self):
+        if not self.summaries:
+            return None
+        return pd.DataFrame({col: summary.describe() for col, summary in self.summaries.items()})
+
+
+def load_upload_cached(uploaded_file, streaming=False, compact=False, job=None):
+    """Parse an uploaded file through the shared content-hash cache.
+
+    ``job`` is checked between parsing, compacting and building the cube; a
+    cancelled load returns ``cancelled_entry()`` and leaves the cache untouched.
+    Progress after each step of a full parse follows ``UPLOAD_PROGRESS``; a
+    streaming parse reports by bytes read instead.
+    """
+    content_key = key = upload_hash(uploaded_file)
+    if streaming:
+        key = f"stream:{key}"
+    if compact:
+        key = f"compact:{key}"
+    cache = get_parsed_upload_cache()
+    entry = cache.get(key)
+    if entry is not None:
+        return entry
+    # A private reader over the upload's bytes, so a cancelled job still reading the
+    # same file never moves this one's position.
+    source = BytesIO(uploaded_file.getvalue())
+    entry = stream_and_validate(source, job=job) if streaming else parse_and_validate(source, job=job)
+    if entry.get('cancelled'):
+        return entry
+    # Stored once per content, whatever the compact setting; a streamed result is
+    # only a sample of the upload, so it is not stored at all.
+    entry['dataset_id'] = None if streaming else content_key
+    entry['name'] = uploaded_file.name
+    if compact and entry['df'] is not None:
+        if job is not None and job.cancelled():
+            return cancelled_entry()
+        with span("compact"):
+            entry['df'], entry['memory_report'] = compact_frame(entry['df'])
+        if job is not None and not streaming:
+            job.report(UPLOAD_PROGRESS['compact'])
+    if entry['df'] is not None and 'cube' not in entry:
+        if job is not None and job.cancelled():
+            return cancelled_entry()
+        with span("build cube"):
+            entry['cube'] = build_cube(entry['df'])
+        if job is not None:
+            job.report(UPLOAD_PROGRESS['build cube'])
+    nbytes = uploaded_file.size if entry['df'] is None else int(entry['df'].memory_usage(deep=True).sum())
+    if entry.get('quarantine') is not None:
+        nbytes += int(entry['quarantine'].memory_usage(deep=True).sum()) + len(entry['quarantine_csv'])
+    if entry.get('cube') is not None:
+        nbytes += int(entry['cube'].memory_usage(deep=True).sum())
+    return cache.put(key, entry, nbytes)
+
+
+def prepare_upload(job, uploaded_file, streaming=False, compact=False):
+    """Job body for an upload: parse, validate and persist it off the script thread.
+
+    Returns the cache entry and a save error message (or ``None``). Cancelling
+    stops it between steps, and the dataset is not saved once cancelled.
+    """
+    with span(f"load {uploaded_file.name}"):
+        entry = load_upload_cached(uploaded_file, streaming=streaming, compact=compact, job=job)
+    if entry.get('cancelled') or job.cancelled():
+        return cancelled_entry(), None
+    save_error = None
+    if entry['dataset_id'] is not None and entry['df'] is not None and not entry['df'].empty:
+        try:
+            with span("save dataset"):
+                save_dataset(entry['dataset_id'], entry['df'], entry['name'], entry['description'], entry['cube'])
+        except (OSError, pa.ArrowException) as e:
+            save_error = str(e)
+    return entry, save_error
+
+
+def start_upload_job(slot, uploaded_file, streaming=False, compact=False):
+    return start_job(slot, (uploaded_file.file_id, streaming, compact), prepare_upload, uploaded_file, streaming, compact)
+
+
+def show_saved_dataset(dataset):
+    start = time.perf_counter()
+    df = open_dataset(dataset['id'])
+    elapsed_ms = (time.perf_counter() - start) * 1000
+    st.info(f"Opened saved dataset `{dataset['name']}` ({dataset['rows']:,} rows, saved {dataset['saved_at']}) in {elapsed_ms:.0f} ms.")
+    st.subheader("Data Description:")
+    if dataset.get('description'):
+        st.dataframe(pd.read_json(StringIO(dataset['description']), orient='split'))
+    else:
+        st.write("No numeric columns available for statistical description.")
+    return df
+
+
+def load_and_validate_data(uploaded_file=None, streaming=False, compact=False, slot='upload:0'):
+    """Load, validate and summarise the upload (or sample data) on the page.
+
+    The upload is parsed by the background job in ``slot``, started here if needed.
+    Returns the validated frame and its aggregate cube, or ``(None, None)``.
+    """
+    save_error = None
+    if uploaded_file is None:
+        # Use synthetic data
+        result = parse_and_validate(sample_data())
+        if compact:
+            result['df'], result['memory_report'] = compact_frame(result['df'])
+        result['cube'] = build_cube(result['df'])
+        st.info("Using sample data. Upload a CSV file to use your own data.")
+    else:
+        job = start_upload_job(slot, uploaded_file, streaming=streaming, compact=compact)
+        result, save_error = wait_for_job(job, f"Parsing and validating {uploaded_file.name}")
+
+    if result['error'] is not None:
+        st.error(result['error'])
+        return None, None
+
+    render_quarantine(result)
+    if result['df'].empty:
+        st.error("No rows passed validation. Download the quarantined rows to see what needs fixing.")
+        return None, None
+
+    if 'rows' in result:
+        st.info(f"Streamed {result['rows']:,} rows in chunks of {STREAM_CHUNK_ROWS:,}. "
+                f"Statistics cover every row; downstream pages use a uniform sample of {len(result['df']):,} rows.")
+
+    if result['has_missing']:
+        st.warning("Warning: Missing values detected in critical fields. The affected rows were quarantined.")
+
+    st.subheader("Data Description:")
+    if result['description'] is not None:
+        st.dataframe(result['description'])
+    else:
+        st.write("No numeric columns available for statistical description.")
+
+    if 'memory_report' in result:
+        render_memory_report(result['memory_report'])
+
+    if save_error is not None:
+        st.warning(f"Could not save the dataset for later sessions: {save_error}")
+
+    st.success("Data loaded and validated successfully.")
+    return result['df'], result['cube']
+
+
+def render_quarantine(result):
+    quarantined_rows = result.get('quarantined_rows', 0)
+    if not quarantined_rows:
+        return
+    quarantine = result['quarantine']
+    st.warning(f"{quarantined_rows:,} rows failed validation and were quarantined; {len(result['df']):,} valid rows were kept.")
+    with st.expander("Quarantined rows"):
+        if quarantined_rows > len(quarantine):
+            st.caption(f"Showing and exporting the first {len(quarantine):,} quarantined rows.")
+        st.dataframe(quarantine.head(1000).astype(str))
+        st.download_button("Download quarantined rows", data=result['quarantine_csv'],
+                           file_name="quarantined_rows.csv", mime="text/csv")
+
+
+def render_memory_report(report):
+    before = int(report['Bytes before'].sum())
+    after = int(report['Bytes after'].sum())
+    with st.expander("Memory report"):
+        col1, col2, col3 = st.columns(3)
+        col1.metric("Before (MB)", f"{before / 1024 ** 2:.2f}")
+        col2.metric("After (MB)", f"{after / 1024 ** 2:.2f}")
+        col3.metric("Saved", f"{1 - after / before:.0%}" if before else "0%")
+        st.dataframe(report, hide_index=True)
+
+
+def render_appended_dataset(appended, outcome=None):
+    if outcome is not None:
+        added, duplicates = outcome
+        st.info(f"Appended {added:,} new trades" + (f"; skipped {duplicates:,} duplicate Trade IDs." if duplicates else "."))
+    if not appended.rows:
+        st.write("No batches appended yet. Upload a CSV to start the dataset.")
+        return
+    cube = appended.cube
+    st.subheader("Combined Dataset:")
+    col1, col2, col3 = st.columns(3)
+    col1.metric("Trades", f"{appended.rows:,}")
+    col2.metric("Batches", len(appended.batch_keys))
+    col3.metric("Date range", f"{cube['Date'].min():%Y-%m-%d} to {cube['Date'].max():%Y-%m-%d}")
+    st.caption("Statistics are updated incrementally from each batch; percentiles are approximate (within 1%).")
+    st.dataframe(appended.describe())
+
+
+def render_upload_cache_stats():
+    stats = get_parsed_upload_cache().stats()
+    total = stats['hits'] + stats['misses']
+    hit_rate = stats['hits'] / total if total else 0.0
+    with st.expander("Upload cache"):
+        col1, col2, col3, col4 = st.columns(4)
+        col1.metric("Cached files", stats['entries'])
+        col2.metric("Cache size (MB)", f"{stats['bytes'] / 1024 ** 2:.1f}")
+        col3.metric("Hits / Misses", f"{stats['hits']} / {stats['misses']}")
+        col4.metric("Hit rate", f"{hit_rate:.0%}")
+
+
+def load_benchmark_table(uploaded_file):
+    """Parse and validate a peer score table through the benchmark cache, keyed by content hash.
+
+    The table needs the four score columns on a 0-100 scale; an optional 'Firm'
+    column names the peers. Rows with missing or out-of-range scores are dropped.
+    Sorted score columns and band percentiles are precomputed for ranking.
+    """
+    key = f"benchmark:{upload_hash(uploaded_file)}"
+    cache = _benchmark_cache
+    entry = cache.get(key)
+    if entry is not None:
+        return entry
+    uploaded_file.seek(0)
+    try:
+        table = pd.read_csv(uploaded_file)
+    except Exception as e:
+        return {'error': f"Error loading benchmark file: {e}. Please ensure it's a valid CSV."}
+    missing = [col for col in SCORE_COLUMNS if col not in table.columns]
+    if missing:
+        return {'error': f"Missing benchmark score columns: {', '.join(f'`{col}`' for col in missing)}."}
+
+    scores = table[SCORE_COLUMNS].apply(pd.to_numeric, errors='coerce').to_numpy(dtype=np.float64)
+    with np.errstate(invalid='ignore'):
+        valid = ~np.isnan(scores).any(axis=1) & (scores >= 0).all(axis=1) & (scores <= 100).all(axis=1)
+    names = table['Firm'].astype(str).to_numpy() if 'Firm' in table.columns else np.arange(1, len(table) + 1).astype(str)
+    scores, names = scores[valid], names[valid]
+    if not len(scores):
+        return {'error': "No benchmark rows with all four scores between 0 and 100."}
+    entry = {
+        'error': None,
+        'scores': scores,
+        'names': names,
+        'sorted': np.sort(scores, axis=0),
+        'bands': np.percentile(scores, BENCHMARK_BAND_PERCENTILES, axis=0),
+        'dropped': int((~valid).sum()),
+    }
+    return cache.put(key, entry, scores.nbytes * 2 + names.nbytes)
+
+
+def benchmark_against_peers(firm_scores, benchmark):
+    """Gap, percentile rank and nearest peers for ``firm_scores`` against a peer table.
+
+    Percentile ranks count peers strictly below plus half of the ties, using binary
+    search on the pre-sorted columns; nearest peers are by Euclidean distance.
+    """
+    firm = np.array([firm_scores[col] for col in SCORE_COLUMNS], dtype=np.float64)
+    ordered = benchmark['sorted']
+    n = len(ordered)
+    below = np.array([np.searchsorted(ordered[:, i], firm[i], side='left') for i in range(len(SCORE_COLUMNS))])
+    at_or_below = np.array([np.searchsorted(ordered[:, i], firm[i], side='right') for i in range(len(SCORE_COLUMNS))])
+    bands = benchmark['bands']
+    median = bands[BENCHMARK_BAND_PERCENTILES.index(50)]
+    upper_quartile = bands[BENCHMARK_BAND_PERCENTILES.index(75)]
+    gaps = pd.DataFrame({
+        'Dimension': SCORE_COLUMNS,
+        'Your Firm': firm,
+        'Peer Median': median,
+        'Gap to Median': firm - median,
+        'Gap to Top Quartile': firm - upper_quartile,
+        'Percentile Rank': (below + at_or_below) / (2 * n) * 100,
+    })
+
+    distances = np.sqrt(((benchmark['scores'] - firm) ** 2).sum(axis=1))
+    k = min(NEAREST_PEERS, n)
+    nearest = np.argpartition(distances, k - 1)[:k]
+    nearest = nearest[np.argsort(distances[nearest], kind='stable')]
+    peers = pd.DataFrame(benchmark['scores'][nearest], columns=SCORE_COLUMNS)
+    peers.insert(0, 'Firm', benchmark['names'][nearest])
+    peers['Distance'] = distances[nearest]
+    return gaps, peers
+
+
+def plot_benchmark_bands(firm_scores, bands):
+    """Peer distribution per dimension as nested percentile bands, with the firm's score on top."""
+    x = np.arange(len(SCORE_COLUMNS))
+    p = dict(zip(BENCHMARK_BAND_PERCENTILES, bands))
+    fig, ax = plt.subplots(figsize=(9, 4))
+    ax.bar(x, p[100] - p[0], 0.6, bottom=p[0], color='#ff7f0e', alpha=0.15, label='Peer min-max')
+    ax.bar(x, p[90] - p[10], 0.6, bottom=p[10], color='#ff7f0e', alpha=0.3, label='Peer 10th-90th pct')
+    ax.bar(x, p[75] - p[25], 0.6, bottom=p[25], color='#ff7f0e', alpha=0.55, label='Peer 25th-75th pct')
+    ax.hlines(p[50], x - 0.3, x + 0.3, color='#a04000', linewidth=2, label='Peer median')
+    ax.scatter(x, [firm_scores[col] for col in SCORE_COLUMNS], s=90, color='#1f77b4', edgecolor='black', zorder=3, label='Your Firm')
+
+    ax.set_xlabel('Quality Areas', fontsize=10)
+    ax.set_ylabel('Scores', fontsize=10)
+    ax.set_title('Your Firm vs Peer Score Distribution', fontsize=14)
+    ax.set_xticks(x)
+    ax.set_xticklabels(SCORE_COLUMNS, fontsize=10)
+    ax.set_ylim(0, 105)
+    ax.legend(fontsize=8, loc='upper left', bbox_to_anchor=(1.01, 1))
+    plt.tight_layout()
+    return fig
+
 
 def run_data_loading_and_analysis():
     st.header("Data Upload, Validation, and Comparative Analysis")
@@ -23,69 +831,79 @@ The integrated workflow eliminates common gaps between data preparation and anal
 """)
 
     # Data Loading and Validation Section
+    profile_section("Upload and validation")
     st.subheader("Data Upload and Validation")
     
-    def load_and_validate_data(uploaded_file=None):
-        if uploaded_file is None:
-            # Use synthetic data
-            data = {
-                'Date': ['2024-01-01', '2024-01-02', '2024-01-03', '2024-01-04', '2024-01-05'],
-                'Cost per Trade': [10.5, 12.3, 11.0, 14.8, 9.7],
-                'Trade ID': [101, 102, 103, 104, 105],
-                'Risk Category': ['Market', 'Operational', 'Credit', 'Market', 'Operational'],
-                'Severity': [5, 7, 4, 6, 8],
-                'Likelihood': [6, 8, 3, 7, 9],
-                'Firm Type': ['A', 'B', 'A', 'B', 'A']
-            }
-            df = pd.DataFrame(data)
-            st.info("Using sample data. Upload a CSV file to use your own data.")
+    saved_datasets = {dataset['id']: dataset for dataset in list_datasets()}
+    picked = None
+    if saved_datasets:
+        picked = st.selectbox("Previously loaded datasets", [None, *saved_datasets],
+                              format_func=lambda i: "None (upload a file or use sample data)" if i is None
+                              else f"{saved_datasets[i]['name']} ({saved_datasets[i]['rows']:,} rows, saved {saved_datasets[i]['saved_at']})",
+                              help=f"Validated uploads are stored on the server and reopened memory-mapped, without re-parsing. "
+                                   f"Only the {DATASET_MAX_COUNT} most recent are kept.")
+
+    if picked is not None:
+        show_saved_dataset(saved_datasets[picked])
+        st.session_state['risklab_dataset'] = picked
+        st.session_state['risklab_df'] = None
+        st.session_state['risklab_cube'] = None
+        st.session_state['risklab_append_mode'] = False
+        if st.button("Delete this saved dataset", help="Remove it from the server for every session."):
+            delete_dataset(picked)
+            st.session_state['risklab_dataset'] = None
+            st.rerun()
+    else:
+        append = st.radio("Upload mode", ['Replace dataset', 'Append to current dataset'], horizontal=True,
+                          help="Append validates each upload on its own and merges it into the dataset, skipping Trade IDs already loaded.") != 'Replace dataset'
+        if append:
+            # A new key after "Clear appended dataset" empties the uploader, so the cleared files are not appended again.
+            uploaded_files = st.file_uploader("Upload your CSV data", type=["csv"], accept_multiple_files=True,
+                                              key=f"append_uploads_{st.session_state.get('risklab_append_generation', 0)}",
+                                              help="Several files are parsed in parallel.")
         else:
-            try:
-                df = pd.read_csv(uploaded_file)
-            except Exception as e:
-                st.error(f"Error loading file: {e}. Please ensure it's a valid CSV.")
-                return None
-
-        required_columns = ['Date', 'Cost per Trade', 'Trade ID', 'Risk Category', 'Severity', 'Likelihood', 'Firm Type']
-        for col in required_columns:
-            if col not in df.columns:
-                st.error(f"Missing required column: `{col}`. Please ensure your CSV has all required columns.")
-                return None
+            uploaded_file = st.file_uploader("Upload your CSV data", type=["csv"])
+            uploaded_files = [uploaded_file] if uploaded_file is not None else []
+        streaming = st.checkbox("Streaming mode for very large files", value=False, disabled=append,
+                                help="Read the upload in bounded chunks and build the Data Description in constant memory. Percentiles are approximate (within 1%). Not available in append mode, which needs every row.")
+        compact = st.checkbox("Compact storage", value=True,
+                              help="Store low-cardinality text columns as categoricals and downcast numeric columns where no information is lost.")
+        streaming = streaming and not append
 
-        try:
-            df['Date'] = pd.to_datetime(df['Date'])
-            df['Cost per Trade'] = pd.to_numeric(df['Cost per Trade'])
-            df['Trade ID'] = pd.to_numeric(df['Trade ID'], downcast='integer')
-            df['Severity'] = pd.to_numeric(df['Severity'], downcast='integer')
-            df['Likelihood'] = pd.to_numeric(df['Likelihood'], downcast='integer')
-        except Exception:
-            st.error("Invalid data type in DataFrame. Please check 'Date', 'Cost per Trade', 'Trade ID', 'Severity', 'Likelihood' columns.")
-            return None
+        # Start every parse before waiting on any, so several uploads are parsed at once;
+        # jobs for files no longer selected are cancelled.
+        slots = [f"upload:{i}" for i in range(len(uploaded_files))]
+        cancel_jobs('upload:', keep=slots)
+        for slot, file in zip(slots, uploaded_files):
+            start_upload_job(slot, file, streaming=streaming, compact=compact)
 
-        if df[required_columns].isnull().any().any():
-            st.warning("Warning: Missing values detected in critical fields. Please review your data.")
+        df = cube = None
+        if not append or not uploaded_files:
+            df, cube = load_and_validate_data(uploaded_files[0] if uploaded_files else None, streaming=streaming, compact=compact)
+        st.session_state['risklab_dataset'] = None
+        st.session_state['risklab_df'] = df
+        st.session_state['risklab_cube'] = cube
+        st.session_state['risklab_df_key'] = (('upload', uploaded_files[0].file_id, streaming, compact)
+                                              if uploaded_files and not append else ('sample', compact))
+        st.session_state['risklab_append_mode'] = append
 
-        st.subheader("Data Description:")
-        # Only describe numeric columns to avoid Arrow serialization issues with datetime
-        numeric_cols = df.select_dtypes(include=[np.number]).columns
-        if len(numeric_cols) > 0:
-            st.dataframe(df[numeric_cols].describe())
-        else:
-            st.write("No numeric columns available for statistical description.")
-            
-        # st.subheader("Data Types:")
-        data_types_df = pd.DataFrame({
-            'Column': df.dtypes.index,
-            'Data Type': df.dtypes.values.astype(str)
-        })
-        # st.dataframe(data_types_df)
-        st.success("Data loaded and validated successfully.")
-        return df
-
-    uploaded_file = st.file_uploader("Upload your CSV data", type=["csv"])
-    df = load_and_validate_data(uploaded_file)
-    st.session_state['risklab_df'] = df
+        if append:
+            appended = st.session_state.setdefault('risklab_appended', AppendedDataset())
+            outcomes = []
+            for slot, file in zip(slots, uploaded_files):
+                with st.expander(f"Validation: {file.name}", expanded=len(uploaded_files) == 1):
+                    batch, _ = load_and_validate_data(file, compact=compact, slot=slot)
+                outcome = appended.append(file.file_id, batch) if batch is not None else None
+                if outcome is not None:
+                    outcomes.append(outcome)
+            render_appended_dataset(appended, tuple(map(sum, zip(*outcomes))) if outcomes else None)
+            if appended.rows and st.button("Clear appended dataset", help="Drop every appended batch and start a new dataset."):
+                del st.session_state['risklab_appended']
+                st.session_state['risklab_append_generation'] = st.session_state.get('risklab_append_generation', 0) + 1
+                st.rerun()
+    render_upload_cache_stats()
 
+    profile_section("Comparative analysis")
     # Add a separator
     st.markdown("---")
 
@@ -128,26 +946,57 @@ Enter scores on a 0-100 scale for both your firm and your chosen benchmark. The
         return fig
 
 
-    col1, col2 = st.columns(2)
-
-    with col1:
-        st.markdown("### Your Firm's Scores (0-100)")
-        firm_output = st.number_input("Output", min_value=0, max_value=100, value=75, key='f_out', help="Score for the quality of outputs produced.")
-        firm_process = st.number_input("Process", min_value=0, max_value=100, value=80, key='f_proc', help="Score for the effectiveness of internal processes.")
-        firm_audience = st.number_input("Audience", min_value=0, max_value=100, value=90, key='f_aud', help="Score for audience satisfaction with risk management.")
-        firm_success = st.number_input("Success", min_value=0, max_value=100, value=70, key='f_succ', help="Score for overall success in achieving risk management goals.")
-        firm_scores = {'Output': firm_output, 'Process': firm_process, 'Audience': firm_audience, 'Success': firm_success}
-
-    with col2:
-        st.markdown("### Benchmark Scores (0-100)")
-        bench_output = st.number_input("Output", min_value=0, max_value=100, value=80, key='b_out', help="Score for benchmark's output quality.")
-        bench_process = st.number_input("Process", min_value=0, max_value=100, value=75, key='b_proc', help="Score for benchmark's process effectiveness.")
-        bench_audience = st.number_input("Audience", min_value=0, max_value=100, value=85, key='b_aud', help="Score for benchmark's audience satisfaction.")
-        bench_success = st.number_input("Success", min_value=0, max_value=100, value=75, key='b_succ', help="Score for benchmark's overall success.")
-        benchmark_scores = {'Output': bench_output, 'Process': bench_process, 'Audience': bench_audience, 'Success': bench_success}
-
-    # Display the comparative analysis chart
-    if st.button("Generate Comparative Analysis", type="primary"):
-        fig = perform_comparative_analysis(firm_scores, benchmark_scores)
-        st.pyplot(fig, use_container_width=False)
+    # A fragment: editing a score or uploading a peer table reruns only this section,
+    # never the dataset load above.
+    @st.fragment
+    def comparative_section():
+        col1, col2 = st.columns(2)
+
+        with col1:
+            st.markdown("### Your Firm's Scores (0-100)")
+            firm_output = st.number_input("Output", min_value=0, max_value=100, value=75, key='f_out', help="Score for the quality of outputs produced.")
+            firm_process = st.number_input("Process", min_value=0, max_value=100, value=80, key='f_proc', help="Score for the effectiveness of internal processes.")
+            firm_audience = st.number_input("Audience", min_value=0, max_value=100, value=90, key='f_aud', help="Score for audience satisfaction with risk management.")
+            firm_success = st.number_input("Success", min_value=0, max_value=100, value=70, key='f_succ', help="Score for overall success in achieving risk management goals.")
+            firm_scores = {'Output': firm_output, 'Process': firm_process, 'Audience': firm_audience, 'Success': firm_success}
+
+        with col2:
+            st.markdown("### Benchmark Scores (0-100)")
+            bench_output = st.number_input("Output", min_value=0, max_value=100, value=80, key='b_out', help="Score for benchmark's output quality.")
+            bench_process = st.number_input("Process", min_value=0, max_value=100, value=75, key='b_proc', help="Score for benchmark's process effectiveness.")
+            bench_audience = st.number_input("Audience", min_value=0, max_value=100, value=85, key='b_aud', help="Score for benchmark's audience satisfaction.")
+            bench_success = st.number_input("Success", min_value=0, max_value=100, value=75, key='b_succ', help="Score for benchmark's overall success.")
+            benchmark_scores = {'Output': bench_output, 'Process': bench_process, 'Audience': bench_audience, 'Success': bench_success}
+
+        # Display the comparative analysis chart
+        if st.button("Generate Comparative Analysis", type="primary"):
+            show_figure(('comparative_analysis', tuple(firm_scores.items()), tuple(benchmark_scores.items())),
+                        lambda: perform_comparative_analysis(firm_scores, benchmark_scores))
+
+        # Peer benchmarking against an uploaded score table
+        st.markdown("### Peer Benchmarking")
+        st.markdown("""
+    Upload a peer survey with one row per firm and `Output`, `Process`, `Audience` and `Success` columns (0-100). An optional `Firm` column names each peer. Your firm's scores above are ranked against every peer, compared with the peer median and top quartile, and matched to the most similar peers.
+    """)
+        benchmark_file = st.file_uploader("Upload peer benchmark scores", type=["csv"], key='benchmark_upload')
+        if benchmark_file is not None:
+            benchmark = load_benchmark_table(benchmark_file)
+            if benchmark['error'] is not None:
+                st.error(benchmark['error'])
+            else:
+                if benchmark['dropped']:
+                    st.warning(f"Skipped {benchmark['dropped']:,} peer rows with missing or out-of-range scores.")
+                gaps, peers = benchmark_against_peers(firm_scores, benchmark)
+                metric_cols = st.columns(len(SCORE_COLUMNS))
+                for metric_col, row in zip(metric_cols, gaps.to_dict('records')):
+                    metric_col.metric(f"{row['Dimension']} percentile", f"{row['Percentile Rank']:.0f}", delta=f"{row['Gap to Median']:+.1f} vs median")
+                show_figure(('benchmark_bands', tuple(firm_scores.items()), benchmark['bands'].tobytes()),
+                            lambda: plot_benchmark_bands(firm_scores, benchmark['bands']))
+                st.caption(f"Ranked against {len(benchmark['scores']):,} peers.")
+                st.dataframe(gaps.style.format({col: '{:.1f}' for col in gaps.columns if col != 'Dimension'}), hide_index=True)
+                st.markdown(f"**{len(peers)} most similar peers:**")
+                st.dataframe(peers.style.format({'Distance': '{:.2f}'}), hide_index=True)
+
+    comparative_section()
+    render_figure_stats()
         
@@ -0,0 +1,189 @@
+import json
+import os
+import uuid
+from datetime import datetime, timezone
+
+import streamlit as st
+import pyarrow as pa
+import pyarrow.feather as feather
+
+from application_pages.caching import LRUCache
+from application_pages.cube import build_cube
+
+# Validated uploads are persisted here as uncompressed Arrow IPC (Feather v2) files.
+DATASET_DIR = os.environ.get('RISKLAB_DATASET_DIR', os.path.join(os.getcwd(), '.risklab_datasets'))
+DATASET_METADATA_KEY = b'risklab'
+# Oldest saved datasets are deleted once either limit is exceeded.
+DATASET_MAX_COUNT = int(os.environ.get('RISKLAB_DATASET_MAX_COUNT', 20))
+DATASET_MAX_BYTES = int(os.environ.get('RISKLAB_DATASET_MAX_BYTES', 2 * 1024 ** 3))
+
+# Frames and cubes opened from the store; kept apart from the parsed-upload cache so
+# reopening a dataset on every rerun neither evicts uploads nor counts toward their hit rate.
+_dataset_cache = LRUCache(max_entries=16)
+
+
+def dataset_path(dataset_id):
+    return os.path.join(DATASET_DIR, f"{dataset_id}.arrow")
+
+
+def cube_path(dataset_id):
+    return os.path.join(DATASET_DIR, f"{dataset_id}.cube")
+
+
+def write_table_atomically(df, path, metadata=None):
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    if metadata is not None:
+        table = table.replace_schema_metadata({**(table.schema.metadata or {}), DATASET_METADATA_KEY: json.dumps(metadata).encode()})
+    tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+    feather.write_feather(table, tmp_path, compression='uncompressed')
+    os.replace(tmp_path, path)
+
+
+def save_dataset(dataset_id, df, name, description=None, cube=None):
+    """Persist a validated frame (and its aggregate cube) unless already stored; returns the file path.
+
+    The file is written uncompressed so it can later be memory-mapped without
+    decoding, and renamed into place so readers never see a partial file.
+    """
+    path = dataset_path(dataset_id)
+    if cube is not None and not os.path.exists(cube_path(dataset_id)):
+        os.makedirs(DATASET_DIR, exist_ok=True)
+        write_table_atomically(cube, cube_path(dataset_id))
+    if os.path.exists(path):
+        return path
+    os.makedirs(DATASET_DIR, exist_ok=True)
+    metadata = {
+        'name': name,
+        'rows': len(df),
+        'saved_at': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'description': description.to_json(orient='split') if description is not None else None,
+    }
+    write_table_atomically(df, path, metadata)
+    prune_datasets(keep=dataset_id)
+    return path
+
+
+def delete_dataset(dataset_id):
+    for path in (dataset_path(dataset_id), cube_path(dataset_id)):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+def dataset_bytes(dataset_id):
+    return sum(os.path.getsize(path) for path in (dataset_path(dataset_id), cube_path(dataset_id)) if os.path.exists(path))
+
+
+def prune_datasets(keep=None):
+    """Delete the oldest saved datasets beyond ``DATASET_MAX_COUNT`` or ``DATASET_MAX_BYTES``."""
+    datasets = list_datasets()
+    total = sum(dataset_bytes(dataset['id']) for dataset in datasets)
+    for dataset in reversed(datasets):
+        if len(datasets) <= DATASET_MAX_COUNT and total <= DATASET_MAX_BYTES:
+            break
+        if dataset['id'] == keep:
+            continue
+        total -= dataset_bytes(dataset['id'])
+        delete_dataset(dataset['id'])
+        datasets.remove(dataset)
+
+
+def read_dataset_metadata(path):
+    schema = pa.ipc.open_file(pa.memory_map(path)).schema
+    metadata = json.loads((schema.metadata or {}).get(DATASET_METADATA_KEY, b'{}'))
+    metadata['id'] = os.path.basename(path)[:-len('.arrow')]
+    metadata['columns'] = schema.names
+    return metadata
+
+
+def list_datasets():
+    if not os.path.isdir(DATASET_DIR):
+        return []
+    datasets = []
+    for filename in os.listdir(DATASET_DIR):
+        if filename.endswith('.arrow'):
+            try:
+                datasets.append(read_dataset_metadata(os.path.join(DATASET_DIR, filename)))
+            except (OSError, pa.ArrowInvalid, ValueError):
+                continue
+    return sorted(datasets, key=lambda meta: meta.get('saved_at', ''), reverse=True)
+
+
+def open_dataset(dataset_id, columns=None):
+    """Open a stored dataset memory-mapped, materialising only ``columns``.
+
+    Numeric columns without nulls are zero-copy views into the mapped file. The
+    resulting frames are shared through the dataset cache.
+    """
+    cache = _dataset_cache
+    key = f"dataset:{dataset_id}:{','.join(columns) if columns else '*'}"
+    entry = cache.get(key)
+    if entry is not None:
+        return entry['df']
+    table = pa.ipc.open_file(pa.memory_map(dataset_path(dataset_id))).read_all()
+    if columns:
+        table = table.select([col for col in columns if col in table.column_names])
+    df = table.to_pandas(split_blocks=True)
+    return cache.put(key, {'df': df}, int(df.memory_usage(deep=True).sum()))['df']
+
+
+def open_dataset_cube(dataset_id):
+    """Aggregate cube of a stored dataset, built and saved next to it on first use."""
+    cache = _dataset_cache
+    key = f"cube:{dataset_id}"
+    entry = cache.get(key)
+    if entry is not None:
+        return entry['df']
+    path = cube_path(dataset_id)
+    cube = feather.read_table(path, memory_map=True).to_pandas() if os.path.exists(path) else None
+    # Cubes saved before 'm2' replaced the raw sum of squares are rebuilt.
+    if cube is None or 'm2' not in cube.columns:
+        cube = build_cube(open_dataset(dataset_id, ['Date', 'Cost per Trade', 'Risk Category', 'Severity', 'Firm Type']))
+        write_table_atomically(cube, path)
+    return cache.put(key, {'df': cube}, int(cube.memory_usage(deep=True).sum()))['df']
+
+
+def appended_dataset():
+    """The session's appended dataset while the Upload mode is on append, else ``None``."""
+    appended = st.session_state.get('risklab_appended')
+    if st.session_state.get('risklab_append_mode') and appended is not None and appended.rows:
+        return appended
+    return None
+
+
+def dataset_identity():
+    """Stable, hashable identity of the data ``load_risklab_frame()`` returns.
+
+    Unlike ``id()`` of the frame, it never matches a different dataset, so it is
+    safe to key cached results and background jobs on.
+    """
+    dataset_id = st.session_state.get('risklab_dataset')
+    if dataset_id is not None and os.path.exists(dataset_path(dataset_id)):
+        return ('dataset', dataset_id)
+    appended = appended_dataset()
+    if appended is not None:
+        return ('appended', appended.uid, appended.version)
+    return st.session_state.get('risklab_df_key')
+
+
+def load_risklab_cube():
+    """Aggregate cube matching ``load_risklab_frame()``, or ``None`` without data."""
+    dataset_id = st.session_state.get('risklab_dataset')
+    if dataset_id is not None and os.path.exists(dataset_path(dataset_id)):
+        return open_dataset_cube(dataset_id)
+    appended = appended_dataset()
+    if appended is not None:
+        return appended.cube
+    return st.session_state.get('risklab_cube', None)
+
+
+def load_risklab_frame(columns=None):
+    """Return the session's dataset, reading only ``columns`` when it is a stored dataset."""
+    dataset_id = st.session_state.get('risklab_dataset')
+    if dataset_id is not None and os.path.exists(dataset_path(dataset_id)):
+        return open_dataset(dataset_id, columns)
+    appended = appended_dataset()
+    if appended is not None:
+        return appended.frame()
+    return st.session_state.get('risklab_df', None)
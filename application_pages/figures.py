@@ -0,0 +1,61 @@
+import threading
+from io import BytesIO
+
+import streamlit as st
+import matplotlib.pyplot as plt
+
+from application_pages.caching import LRUCache
+from application_pages.profiling import span
+
+# Rendered matplotlib figures (PNG bytes), keyed by the inputs that drew them.
+_figure_cache = LRUCache(max_entries=256, max_bytes=64 * 1024 ** 2)
+_figure_render_lock = threading.Lock()
+_figures_created = 0
+
+
+def render_figure(key, build_figure, dpi=200):
+    """PNG bytes and display width for the figure ``build_figure()`` draws, cached by ``key``.
+
+    ``key`` must capture every input of the figure. On a miss the figure is built,
+    saved and closed straight away, even on error, so no pyplot figure outlives the
+    call; pyplot state is global, so rendering is serialised.
+    """
+    global _figures_created
+    entry = _figure_cache.get(key)
+    if entry is not None:
+        return entry['png'], entry['width']
+    with _figure_render_lock:
+        already_open = set(plt.get_fignums())
+        try:
+            with span("draw figure"):
+                fig = build_figure()
+            _figures_created += 1
+            buffer = BytesIO()
+            with span("encode PNG"):
+                fig.savefig(buffer, format='png', dpi=dpi, bbox_inches='tight')
+            width = int(fig.get_size_inches()[0] * 100)
+        finally:
+            # Also closes figures left behind when build_figure() raises part-way.
+            for number in set(plt.get_fignums()) - already_open:
+                plt.close(number)
+    png = buffer.getvalue()
+    entry = _figure_cache.put(key, {'png': png, 'width': width}, len(png))
+    return entry['png'], entry['width']
+
+
+def show_figure(key, build_figure, use_container_width=False):
+    png, width = render_figure(key, build_figure)
+    if use_container_width:
+        st.image(png, use_container_width=True)
+    else:
+        st.image(png, width=width)
+
+
+def figure_stats():
+    return {**_figure_cache.stats(), 'created': _figures_created, 'open': len(plt.get_fignums())}
+
+
+def render_figure_stats():
+    stats = figure_stats()
+    st.sidebar.caption(f"Figures drawn: {stats['created']} · open: {stats['open']} · "
+                       f"render cache: {stats['entries']} images, {stats['hits']} hits / {stats['misses']} misses")
@@ -0,0 +1,94 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+
+import streamlit as st
+
+from application_pages.profiling import attached, current_recorder, span
+
+# Background jobs: parsing, validation and chart preparation run on a bounded thread pool
+# shared by every session, so several uploads parse at once and the script thread stays free.
+JOB_WORKERS = min(4, os.cpu_count() or 1)
+JOB_POLL_SECONDS = 0.1
+
+
+class BackgroundJob:
+    """One unit of work on the shared job pool, with cooperative cancellation and progress.
+
+    ``fn`` is called as ``fn(job, *args)``; long-running work should check
+    ``job.cancelled()`` and call ``job.report(fraction)`` between steps.
+    """
+
+    def __init__(self, key, fn, *args):
+        self.key = key
+        self.progress = None
+        self._cancel = threading.Event()
+        # Spans recorded by the job go to the run that started it.
+        self.future = _job_pool.submit(self._run, current_recorder(), fn, *args)
+
+    def _run(self, recorder, fn, *args):
+        with attached(recorder):
+            return fn(self, *args)
+
+    def cancelled(self):
+        return self._cancel.is_set()
+
+    def cancel(self):
+        self._cancel.set()
+        self.future.cancel()
+
+    def report(self, fraction):
+        self.progress = min(max(float(fraction), 0.0), 1.0)
+
+    def reusable(self):
+        return not self.cancelled() and not (self.future.done() and self.future.exception() is not None)
+
+
+_job_pool = ThreadPoolExecutor(max_workers=JOB_WORKERS, thread_name_prefix='risklab-job')
+
+
+def session_jobs():
+    return st.session_state.setdefault('risklab_jobs', {})
+
+
+def start_job(slot, key, fn, *args):
+    """Start ``fn`` for ``slot`` unless the job already running there has the same ``key``.
+
+    A job whose inputs changed is cancelled, so a rerun never waits on stale work
+    and an unrelated widget change never restarts it.
+    """
+    jobs = session_jobs()
+    job = jobs.get(slot)
+    if job is not None and job.key == key and job.reusable():
+        return job
+    if job is not None:
+        job.cancel()
+    job = jobs[slot] = BackgroundJob(key, fn, *args)
+    return job
+
+
+def cancel_jobs(prefix, keep=()):
+    """Cancel and forget every job whose slot starts with ``prefix`` and is not in ``keep``."""
+    jobs = session_jobs()
+    for slot in [slot for slot in jobs if slot.startswith(prefix) and slot not in keep]:
+        jobs.pop(slot).cancel()
+
+
+def wait_for_job(job, label):
+    """Show a progress bar until ``job`` finishes and return its result."""
+    if not job.future.done():
+        with span(f"wait: {label}"):
+            bar = st.progress(0.0, text=label)
+            while not wait([job.future], timeout=JOB_POLL_SECONDS).done:
+                if job.progress is not None:
+                    bar.progress(job.progress, text=f"{label} ({job.progress:.0%})")
+            bar.empty()
+    return job.future.result()
+
+
+def run_in_background(slot, key, label, fn, *args):
+    """Run ``fn(*args)`` on the job pool for ``slot`` and wait for its result."""
+    def run(job):
+        with span(label):
+            return fn(*args)
+    return wait_for_job(start_job(slot, key, run), label)
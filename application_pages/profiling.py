@@ -0,0 +1,296 @@
+import json
+import os
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager, nullcontext
+from datetime import datetime, timezone
+
+import streamlit as st
+import pandas as pd
+
+# Profiling is off unless the sidebar toggle (default from RISKLAB_PROFILE) is on.
+PROFILE_DEFAULT = os.environ.get('RISKLAB_PROFILE', '') not in ('', '0')
+# Recorded runs kept per session for the JSON export.
+PROFILE_HISTORY = 20
+# Span memory source: 'rss' samples resident memory every RSS_SAMPLE_SECONDS on a
+# helper thread (cheap, covers job threads); 'tracemalloc' traces Python allocations
+# (precise, but slows every session on the server and covers the script thread only);
+# 'off' records time only. Set from the environment only.
+PROFILE_MEMORY = os.environ.get('RISKLAB_PROFILE_MEMORY', 'rss').lower()
+RSS_SAMPLE_SECONDS = 0.01
+MEMORY_CAPTIONS = {
+    'rss': "Peak MB is the resident memory peak above the span's start, sampled every 10 ms for the whole process.",
+    'tracemalloc': "Peak MB is the traced allocation peak above the span's start, measured on the script thread only.",
+}
+
+_current = threading.local()
+_tracing_lock = threading.Lock()
+_tracing_runs = 0
+_started_tracing = False
+# The one thread allowed to read and reset the tracemalloc peak; see ProfileRecorder.
+_tracing_owner = None
+
+
+def read_rss():
+    """Resident set size of this process in bytes, or ``None`` where ``/proc`` is unavailable."""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError, AttributeError):
+        return None
+
+
+class RssSampler:
+    """Raises the ``'peak'`` of every open span to the process RSS, sampled on a helper thread.
+
+    RSS is read without resetting anything, so spans on any thread (script or
+    background jobs) get a peak; it is process-wide, so concurrent sessions show
+    up in each other's peaks, and spikes shorter than a sample can be missed.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._open = {}
+        self._runs = 0
+        self._stopped = None
+
+    def start(self):
+        with self._lock:
+            self._runs += 1
+            if self._runs == 1:
+                self._stopped = threading.Event()
+                threading.Thread(target=self._run, args=(self._stopped,), name='risklab-rss', daemon=True).start()
+
+    def stop(self):
+        with self._lock:
+            self._runs -= 1
+            if self._runs == 0:
+                self._stopped.set()
+
+    def _run(self, stopped):
+        while not stopped.wait(RSS_SAMPLE_SECONDS):
+            rss = read_rss()
+            if rss is None:
+                return
+            with self._lock:
+                for frame in self._open.values():
+                    frame['peak'] = max(frame['peak'], rss)
+
+    def open(self, frame):
+        rss = read_rss()
+        if rss is not None:
+            frame['base'] = frame['peak'] = rss
+            with self._lock:
+                self._open[id(frame)] = frame
+
+    def close(self, frame):
+        """Peak bytes above ``frame``'s start, or ``None`` if RSS could not be read."""
+        with self._lock:
+            if self._open.pop(id(frame), None) is None:
+                return None
+        return max(frame['peak'], read_rss() or 0) - frame['base']
+
+
+_rss_sampler = RssSampler()
+
+
+class ProfileRecorder:
+    """Wall-clock and peak-memory spans for one script run.
+
+    Spans nest per thread; work started from the run on other threads (background
+    jobs) records into the same recorder at depth 0 of its own thread. Peak
+    memory comes from ``PROFILE_MEMORY``. With ``'rss'`` every span gets the
+    sampled process RSS peak above its start. With ``'tracemalloc'`` the peak is
+    process-wide and has to be reset at every span boundary, so only the script
+    thread that owns tracing records peaks; spans on any other thread (background
+    jobs, runs of other sessions profiled at the same time) record time only,
+    with ``peak_bytes`` ``None``, and the owner's peaks still include whatever
+    those threads allocate meanwhile.
+    """
+
+    def __init__(self, page):
+        self.page = page
+        self.started_at = datetime.now(timezone.utc).isoformat(timespec='seconds')
+        self.origin = time.perf_counter()
+        self.spans = []
+        self._local = threading.local()
+
+    def _stack(self):
+        if not hasattr(self._local, 'stack'):
+            self._local.stack = []
+        return self._local.stack
+
+    def begin(self, name, section=False):
+        stack = self._stack()
+        frame = {'name': name, 'section': section, 'peak': 0, 'base': 0}
+        if PROFILE_MEMORY == 'rss':
+            _rss_sampler.open(frame)
+        elif _owns_tracing():
+            current, peak = tracemalloc.get_traced_memory()
+            if stack:
+                stack[-1]['peak'] = max(stack[-1]['peak'], peak)
+            tracemalloc.reset_peak()
+            frame['base'] = current
+        frame['start'] = time.perf_counter()
+        stack.append(frame)
+        return frame
+
+    def end(self, frame):
+        """Close ``frame`` and any sections still open inside it."""
+        stack = self._stack()
+        while stack and stack[-1] is not frame:
+            self._finish(stack.pop(), stack)
+        if stack:
+            self._finish(stack.pop(), stack)
+
+    def section(self, name):
+        """Close the open section at this level (if any) and start the next one."""
+        stack = self._stack()
+        if stack and stack[-1]['section']:
+            self._finish(stack.pop(), stack)
+        self.begin(name, section=True)
+
+    def _finish(self, frame, stack):
+        seconds = time.perf_counter() - frame['start']
+        peak_bytes = None
+        if PROFILE_MEMORY == 'rss':
+            peak_bytes = _rss_sampler.close(frame)
+        elif _owns_tracing():
+            peak = max(frame['peak'], tracemalloc.get_traced_memory()[1])
+            tracemalloc.reset_peak()
+            if stack:
+                stack[-1]['peak'] = max(stack[-1]['peak'], peak)
+            peak_bytes = max(peak - frame['base'], 0)
+        self.spans.append({
+            'span': ' / '.join([*(f['name'] for f in stack), frame['name']]),
+            'depth': len(stack),
+            'thread': threading.current_thread().name,
+            'start': frame['start'] - self.origin,
+            'seconds': seconds,
+            'peak_bytes': peak_bytes,
+        })
+
+    def to_dict(self):
+        return {
+            'page': self.page,
+            'started_at': self.started_at,
+            'memory': PROFILE_MEMORY,
+            'spans': sorted(self.spans, key=lambda s: s['start']),
+        }
+
+
+def current_recorder():
+    return getattr(_current, 'recorder', None)
+
+
+@contextmanager
+def attached(recorder):
+    """Record spans on this thread into ``recorder`` (used by background job threads)."""
+    previous = current_recorder()
+    _current.recorder = recorder
+    try:
+        yield
+    finally:
+        _current.recorder = previous
+
+
+def span(name):
+    """Context manager timing ``name`` in the current run; a no-op when profiling is off."""
+    recorder = current_recorder()
+    if recorder is None:
+        return nullcontext()
+    return _span(recorder, name)
+
+
+@contextmanager
+def _span(recorder, name):
+    frame = recorder.begin(name)
+    try:
+        yield
+    finally:
+        recorder.end(frame)
+
+
+def profile_section(name):
+    """Mark the start of a page section; it runs until the next section or the end of the page."""
+    recorder = current_recorder()
+    if recorder is not None:
+        recorder.section(name)
+
+
+def _start_memory():
+    if PROFILE_MEMORY == 'rss':
+        _rss_sampler.start()
+    elif PROFILE_MEMORY == 'tracemalloc':
+        _start_tracing()
+
+
+def _stop_memory():
+    if PROFILE_MEMORY == 'rss':
+        _rss_sampler.stop()
+    elif PROFILE_MEMORY == 'tracemalloc':
+        _stop_tracing()
+
+
+def _owns_tracing():
+    return _tracing_owner == threading.get_ident() and tracemalloc.is_tracing()
+
+
+def _start_tracing():
+    global _tracing_runs, _started_tracing, _tracing_owner
+    with _tracing_lock:
+        if _tracing_runs == 0 and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            _started_tracing = True
+        if _tracing_owner is None:
+            _tracing_owner = threading.get_ident()
+        _tracing_runs += 1
+
+
+def _stop_tracing():
+    global _tracing_runs, _started_tracing, _tracing_owner
+    with _tracing_lock:
+        _tracing_runs -= 1
+        if _tracing_owner == threading.get_ident():
+            _tracing_owner = None
+        if _tracing_runs == 0 and _started_tracing:
+            tracemalloc.stop()
+            _started_tracing = False
+
+
+@contextmanager
+def profiled_run(page, enabled):
+    """Profile one run of ``page`` when ``enabled``, keeping it in the session's history."""
+    if not enabled:
+        yield
+        return
+    recorder = ProfileRecorder(page)
+    history = st.session_state.setdefault('risklab_profiles', [])
+    history.append(recorder)
+    del history[:-PROFILE_HISTORY]
+    _start_memory()
+    try:
+        with attached(recorder), _span(recorder, page):
+            yield
+    finally:
+        _stop_memory()
+
+
+def render_profile_panel():
+    history = st.session_state.get('risklab_profiles')
+    if not history:
+        return
+    latest = history[-1].to_dict()
+    with st.sidebar.expander("Performance", expanded=True):
+        spans = pd.DataFrame(latest['spans'], columns=['span', 'depth', 'thread', 'start', 'seconds', 'peak_bytes'])
+        table = pd.DataFrame({
+            'Span': [' ' * depth + span.rsplit(' / ', 1)[-1] for span, depth in zip(spans['span'], spans['depth'])],
+            'Seconds': spans['seconds'],
+            'Peak MB': spans['peak_bytes'].astype(float) / 1024 ** 2,
+            'Thread': spans['thread'],
+        })
+        st.caption(f"Last run of {latest['page']} at {latest['started_at']}. {MEMORY_CAPTIONS.get(latest['memory'], '')}")
+        st.dataframe(table.style.format({'Seconds': '{:.3f}', 'Peak MB': '{:.1f}'}, na_rep='-'), hide_index=True)
+        st.download_button("Export runs as JSON", json.dumps([run.to_dict() for run in history], indent=2),
+                           file_name="risklab_profile.json", mime="application/json")
@@ -1,8 +1,71 @@
 
 import streamlit as st
 import numpy as np
+import pandas as pd
 import matplotlib.pyplot as plt
 
+from application_pages.datasets import load_risklab_frame
+from application_pages.figures import render_figure_stats, show_figure
+from application_pages.profiling import profile_section
+
+# Quadrant codes are (likelihood > 5) + 2 * (severity > 5).
+QUADRANTS = ['Ignore', 'Monitor', 'Cost', 'Strategic Risk']
+QUADRANT_COLORS = ['gray', '#1f77b4', '#ff7f0e', 'red']
+QUADRANT_ROWS_SHOWN = 1000
+
+
+def classify_risk_quadrants(severity, likelihood):
+    """Quadrant code (index into ``QUADRANTS``) for every row, in one vectorized step."""
+    severity = np.asarray(severity)
+    likelihood = np.asarray(likelihood)
+    return (likelihood > 5).astype(np.int8) + 2 * (severity > 5).astype(np.int8)
+
+
+def summarize_quadrants(codes, cost):
+    counts = np.bincount(codes, minlength=len(QUADRANTS))
+    cost_totals = np.bincount(codes, weights=np.asarray(cost, dtype=np.float64), minlength=len(QUADRANTS))
+    return pd.DataFrame({
+        'Quadrant': QUADRANTS,
+        'Trades': counts,
+        'Share': counts / max(counts.sum(), 1),
+        'Total Cost': cost_totals,
+    })
+
+
+def risk_count_grid(severity, likelihood):
+    """10x10 array of trade counts; row ``s - 1`` and column ``l - 1`` hold severity ``s`` and likelihood ``l``."""
+    cells = (np.asarray(severity, dtype=np.int64) - 1) * 10 + (np.asarray(likelihood, dtype=np.int64) - 1)
+    return np.bincount(cells, minlength=100).reshape(10, 10)
+
+
+def plot_risk_grid(grid):
+    fig, ax = plt.subplots(figsize=(5, 4))
+    image = ax.imshow(grid, origin='lower', extent=(0.5, 10.5, 0.5, 10.5), cmap='Blues', aspect='auto')
+    fig.colorbar(image, ax=ax, label='Trades')
+    peak = grid.max()
+    for s in range(10):
+        for l in range(10):
+            if grid[s, l]:
+                ax.text(l + 1, s + 1, f"{grid[s, l]:,}", fontsize=6, ha='center', va='center',
+                        color='white' if grid[s, l] > peak / 2 else 'black')
+
+    ax.set_xlabel("Likelihood (1-10)", fontsize=9)
+    ax.set_ylabel("Severity (1-10)", fontsize=9)
+    ax.set_title("Portfolio Risk Profile", fontsize=10)
+    ax.set_xticks(np.arange(1, 11, 1))
+    ax.set_yticks(np.arange(1, 11, 1))
+
+    # Boundaries sit between scores 5 and 6, matching classify_risk_quadrants.
+    ax.axvline(x=5.5, color='black', linestyle='--', linewidth=0.8)
+    ax.axhline(y=5.5, color='black', linestyle='--', linewidth=0.8)
+    # Quadrant names go in blank strips above and below the cells so they never cover a count.
+    ax.set_ylim(-0.2, 11.2)
+    for (x, y), name, color in zip([(3, 0.15), (8, 0.15), (3, 10.85), (8, 10.85)], QUADRANTS, QUADRANT_COLORS):
+        ax.text(x, y, name, fontsize=8, ha='center', va='center', weight='bold', color=color)
+    plt.tight_layout()
+    return fig
+
+
 def run_risk_profile():
     st.header("Interactive Risk Profile Grid")
     st.markdown(r"""
@@ -47,6 +110,7 @@ This grid methodology directly supports regulatory compliance frameworks, strate
         return fig
 
     # Risk input controls in sidebar
+    profile_section("Single risk plot")
     st.sidebar.subheader("Risk Parameters")
     risk_name_input = st.sidebar.text_input("Risk Name", value="Data Breach", help="Enter a name for the risk to plot.")
     likelihood_input = st.sidebar.slider("Likelihood (1=Low, 10=High)", min_value=1, max_value=10, value=8, help="Likelihood of the risk occurring.")
@@ -55,4 +119,38 @@ This grid methodology directly supports regulatory compliance frameworks, strate
     # Use columns to control width
     col1, col2, col3 = st.columns([1, 2, 1])
     with col2:
-        st.pyplot(plot_risk_profile(severity=severity_input, likelihood=likelihood_input, risk_name=risk_name_input), use_container_width=True)
\ No newline at end of file
+        show_figure(('risk_profile', severity_input, likelihood_input, risk_name_input),
+                    lambda: plot_risk_profile(severity=severity_input, likelihood=likelihood_input, risk_name=risk_name_input),
+                    use_container_width=True)
+
+    # Portfolio view of every loaded trade
+    profile_section("Portfolio grid")
+    df = load_risklab_frame()
+    if df is not None and not df.empty:
+        st.markdown("---")
+        st.subheader("Portfolio Risk Profile")
+        st.markdown(r"""
+Every trade in the loaded dataset already carries a Severity and Likelihood score. The grid below assigns all of them to the four quadrants at once and shows how many trades, and how much cost, sit in each quadrant. Scores above 5 count as high.
+""")
+        codes = classify_risk_quadrants(df['Severity'].to_numpy(), df['Likelihood'].to_numpy())
+        summary = summarize_quadrants(codes, df['Cost per Trade'].to_numpy())
+
+        col1, col2 = st.columns([3, 2])
+        with col1:
+            grid = risk_count_grid(df['Severity'].to_numpy(), df['Likelihood'].to_numpy())
+            show_figure(('risk_grid', grid.tobytes()), lambda: plot_risk_grid(grid), use_container_width=True)
+        with col2:
+            st.dataframe(summary.style.format({'Trades': '{:,}', 'Share': '{:.1%}', 'Total Cost': '{:,.2f}'}), hide_index=True)
+
+        # Switching quadrant reruns only this fragment, not the grid above.
+        @st.fragment
+        def quadrant_trades():
+            quadrant = st.radio("Show trades in quadrant", QUADRANTS, horizontal=True)
+            selected = df.loc[codes == QUADRANTS.index(quadrant)]
+            st.caption(f"{len(selected):,} trades in {quadrant}" + (f"; showing the first {QUADRANT_ROWS_SHOWN:,}." if len(selected) > QUADRANT_ROWS_SHOWN else "."))
+            st.dataframe(selected.head(QUADRANT_ROWS_SHOWN), hide_index=True)
+
+        profile_section("Quadrant drill-down")
+        quadrant_trades()
+
+    render_figure_stats()
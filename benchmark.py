@@ -0,0 +1,189 @@
+"""Headless benchmarks for the load/validate, variability, aggregation and plotting paths.
+
+Each case runs on synthetic trades at every requested size and reports its best wall
+time over ``--repeat`` runs plus the peak traced memory of one extra run. Nothing
+starts Streamlit or a browser, so this can run in CI before a deploy:
+
+    python benchmark.py                                # 1e3 .. 1e7 rows
+    python benchmark.py --sizes 1e3,1e5 --output results.json
+    python benchmark.py --baseline results.json        # exit 1 on a regression
+"""
+import argparse
+import itertools
+import json
+import sys
+import time
+import tracemalloc
+from io import BytesIO
+
+import numpy as np
+import pandas as pd
+import plotly.express as px
+
+from application_pages.analytics_and_visualizations import (
+    TREND_BUCKETS, cost_variability, cube_variability, daily_trend, grouped_cost_variability, prepare_trend_series,
+)
+from application_pages.cube import build_cube
+from application_pages.data_loading_and_analysis import compact_frame, parse_and_validate, stream_and_validate
+from application_pages.figures import render_figure
+from application_pages.risk_profile import classify_risk_quadrants, plot_risk_grid, risk_count_grid, summarize_quadrants
+
+DEFAULT_SIZES = [10 ** 3, 10 ** 4, 10 ** 5, 10 ** 6, 10 ** 7]
+# Cases faster than this in the baseline are too noisy to flag as regressions.
+NOISE_FLOOR_SECONDS = 0.005
+
+_figure_keys = itertools.count()
+
+
+def synthetic_trades(rows, seed=0, bad_fraction=0.001):
+    """Trades with the required columns over four years; ``bad_fraction`` of rows fail validation."""
+    rng = np.random.default_rng(seed)
+    seconds = np.sort(rng.integers(0, 4 * 365 * 86400, rows))
+    df = pd.DataFrame({
+        'Date': pd.Timestamp('2020-01-01') + pd.to_timedelta(seconds, unit='s'),
+        'Cost per Trade': rng.gamma(2.0, 6.0, rows).round(2),
+        'Trade ID': np.arange(rows),
+        'Risk Category': rng.choice(['Market', 'Credit', 'Operational', 'Liquidity'], rows),
+        'Severity': rng.integers(1, 11, rows),
+        'Likelihood': rng.integers(1, 11, rows),
+        'Firm Type': rng.choice(['A', 'B', 'C'], rows),
+    })
+    bad = rng.choice(rows, int(rows * bad_fraction), replace=False)
+    df.loc[bad, 'Severity'] = 11
+    return df
+
+
+def build_context(rows, seed):
+    """Inputs shared by the cases at one size; built once and not timed."""
+    csv = synthetic_trades(rows, seed).to_csv(index=False).encode()
+    df = parse_and_validate(BytesIO(csv))['df']
+    cube = build_cube(df)
+    return {
+        'csv': csv,
+        'df': df,
+        'cube': cube,
+        'grid': risk_count_grid(df['Severity'].to_numpy(), df['Likelihood'].to_numpy()),
+        'trend': prepare_trend_series(df, buckets=TREND_BUCKETS)[0],
+    }
+
+
+def plot_to_png(grid):
+    # A fresh key every call, so the figure cache never serves the result.
+    return render_figure(('benchmark', next(_figure_keys)), lambda: plot_risk_grid(grid))
+
+
+CASES = [
+    ('load/validate', 'parse_and_validate', lambda c: parse_and_validate(BytesIO(c['csv']))),
+    ('load/validate', 'stream_and_validate', lambda c: stream_and_validate(BytesIO(c['csv']))),
+    ('load/validate', 'compact_frame', lambda c: compact_frame(c['df'])),
+    ('variability', 'cost_variability', lambda c: cost_variability(c['df']['Cost per Trade'].to_numpy())),
+    ('variability', 'cube_variability', lambda c: cube_variability(c['cube'])),
+    ('variability', 'grouped (rows)', lambda c: grouped_cost_variability(c['df'], by=['Risk Category'], freq='W')),
+    ('variability', 'grouped (cube)', lambda c: grouped_cost_variability(c['df'], by=['Risk Category'], freq='W', cube=c['cube'])),
+    ('aggregation', 'build_cube', lambda c: build_cube(c['df'])),
+    ('aggregation', 'describe', lambda c: c['df'].describe()),
+    ('aggregation', 'risk quadrants', lambda c: summarize_quadrants(
+        classify_risk_quadrants(c['df']['Severity'].to_numpy(), c['df']['Likelihood'].to_numpy()), c['df']['Cost per Trade'].to_numpy())),
+    ('aggregation', 'daily_trend', lambda c: daily_trend(c['cube'])),
+    ('plotting', 'prepare_trend_series', lambda c: prepare_trend_series(c['df'], buckets=TREND_BUCKETS)),
+    ('plotting', 'trend chart JSON', lambda c: px.line(c['trend'], x='Date', y='Cost per Trade', render_mode='webgl').to_json()),
+    ('plotting', 'risk grid PNG', lambda c: plot_to_png(c['grid'])),
+]
+
+
+def measure(fn, context, repeat, memory):
+    seconds = min(_timed(fn, context) for _ in range(repeat))
+    peak_bytes = None
+    if memory:
+        tracemalloc.start()
+        try:
+            fn(context)
+            peak_bytes = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+    return seconds, peak_bytes
+
+
+def _timed(fn, context):
+    start = time.perf_counter()
+    fn(context)
+    return time.perf_counter() - start
+
+
+def run_benchmarks(sizes, repeat=3, memory=True, seed=0, cases=None):
+    results = []
+    for rows in sizes:
+        started = time.perf_counter()
+        context = build_context(rows, seed)
+        print(f"{rows:>12,} rows: built inputs in {time.perf_counter() - started:.1f} s", file=sys.stderr)
+        for group, name, fn in CASES:
+            if cases and name not in cases:
+                continue
+            seconds, peak_bytes = measure(fn, context, repeat, memory)
+            results.append({'group': group, 'case': name, 'rows': rows, 'seconds': seconds, 'peak_bytes': peak_bytes})
+            print(f"{'':>12}  {group}/{name}: {seconds:.4f} s", file=sys.stderr)
+        del context
+    return results
+
+
+def find_regressions(results, baseline, tolerance):
+    """Cases whose time grew beyond ``tolerance`` times the baseline."""
+    previous = {(r['case'], r['rows']): r['seconds'] for r in baseline}
+    regressions = []
+    for r in results:
+        before = previous.get((r['case'], r['rows']))
+        if before is not None and before >= NOISE_FLOOR_SECONDS and r['seconds'] > before * tolerance:
+            regressions.append({**r, 'baseline_seconds': before})
+    return regressions
+
+
+def results_table(results):
+    table = pd.DataFrame(results)
+    seconds = table.pivot_table(index=['group', 'case'], columns='rows', values='seconds', sort=False)
+    seconds.columns = [f"{rows:,} rows (s)" for rows in seconds.columns]
+    if table['peak_bytes'].notna().any():
+        peak = table.pivot_table(index=['group', 'case'], columns='rows', values='peak_bytes', sort=False) / 1024 ** 2
+        peak.columns = [f"{rows:,} rows (MB)" for rows in peak.columns]
+        seconds = seconds.join(peak)
+    return seconds
+
+
+def parse_sizes(text):
+    return [int(float(size)) for size in text.split(',') if size.strip()]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=parse_sizes, default=DEFAULT_SIZES,
+                        help="Comma-separated row counts (default: 1e3,1e4,1e5,1e6,1e7).")
+    parser.add_argument('--repeat', type=int, default=3, help="Timed runs per case; the fastest is reported.")
+    parser.add_argument('--cases', type=lambda text: [case.strip() for case in text.split(',')],
+                        help="Only run these case names.")
+    parser.add_argument('--no-memory', dest='memory', action='store_false', help="Skip the traced peak-memory run.")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help="Write the results as JSON.")
+    parser.add_argument('--baseline', help="JSON from an earlier --output run to compare against.")
+    parser.add_argument('--tolerance', type=float, default=1.5,
+                        help="Fail when a case takes more than this multiple of its baseline time.")
+    args = parser.parse_args(argv)
+
+    results = run_benchmarks(args.sizes, repeat=args.repeat, memory=args.memory, seed=args.seed, cases=args.cases)
+    with pd.option_context('display.width', 200, 'display.max_columns', None, 'display.float_format', '{:.4f}'.format):
+        print(results_table(results))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = find_regressions(results, json.load(f), args.tolerance)
+        for r in regressions:
+            print(f"REGRESSION {r['group']}/{r['case']} at {r['rows']:,} rows: "
+                  f"{r['seconds']:.4f} s vs {r['baseline_seconds']:.4f} s", file=sys.stderr)
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())